@@ -8,22 +8,38 @@ import os
 import logging
 import sqlite3
 import threading
+import multiprocessing
 import io
+import tempfile
+import mmap
 import zipfile
 import random
-from datetime import datetime, time, timedelta
-from typing import Dict, List, Optional, Tuple
+import time
+import queue
+import atexit
+import json
+from datetime import datetime
+from typing import BinaryIO, Dict, List, Optional, Tuple
 from pathlib import Path
-import glob
 import asyncio
 import re
+from collections import ChainMap, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial, wraps
+from urllib.parse import quote
 
-from flask import Flask, request, jsonify
+try:
+    import uvloop
+except ImportError:
+    # Windows u otros entornos sin uvloop: bucle estándar de asyncio
+    uvloop = None
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, 
     ContextTypes, CallbackQueryHandler, filters,
-    ConversationHandler, JobQueue
+    ConversationHandler, JobQueue, BaseUpdateProcessor
 )
 
 # ============================================================================
@@ -31,7 +47,7 @@ from telegram.ext import (
 # ============================================================================
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
-ADMIN_IDS = [int(id.strip()) for id in os.getenv('ADMIN_IDS', '').split(',') if id.strip()]
+ADMIN_IDS = frozenset(int(id.strip()) for id in os.getenv('ADMIN_IDS', '').split(',') if id.strip())
 BOT_OWNER = "@iberic_owner"
 BOT_NAME = "🔍 ULP Searcher Bot"
 BOT_VERSION = "7.2 COMPLETE EN - DNI FIXED"
@@ -41,12 +57,71 @@ RESET_HOUR = 0
 # Referral system
 REFERRAL_BONUS = 1
 
+# /userslist pagination (una página debe caber en un mensaje de Telegram)
+USERS_PAGE_SIZE = 20
+USERS_PAGE_MAX = 40
+
+# Extensiones (en minúsculas) de los archivos de datos
+DATA_FILE_EXTS = frozenset({'.txt'})
+
+# Subidas de admins: la Bot API no descarga archivos de más de 20MB
+MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+UPLOAD_MIME_TYPES = frozenset({'text/plain', 'application/octet-stream'})
+# Descargas por debajo de este tamaño se quedan en memoria: con el límite
+# de la Bot API, todas, y el archivo se escribe una sola vez en DATA_DIR
+UPLOAD_SPOOL_SIZE = MAX_UPLOAD_SIZE
+
+# Bytes que se pasan a minúsculas de una vez al recorrer un archivo
+SCAN_BLOCK_SIZE = 8 * 1024 * 1024
+# Procesos para recorrer archivos en paralelo (uno por archivo y núcleo)
+SEARCH_WORKERS = os.cpu_count() or 1
+# Cada cuánto (segundos) un MmapCache suelta los mapas de archivos borrados
+# o reemplazados, aunque nadie los vuelva a pedir
+MMAP_PRUNE_INTERVAL = 60
+# /multisearch: textos por consulta (todos comparten una pasada por archivo)
+MULTISEARCH_MAX_NEEDLES = 50
+
+# Broadcast: Telegram admite ~30 mensajes/segundo
+BROADCAST_RATE = 30
+# Workers que envían en paralelo (comparten el límite BROADCAST_RATE)
+BROADCAST_CONCURRENCY = 25
+# Usuarios leídos por página de la DB; el progreso se edita tras cada una
+BROADCAST_BATCH_SIZE = 500
+
+# Log de transacciones: se escribe en lotes desde un hilo aparte
+TRANSACTION_FLUSH_INTERVAL = 0.2
+TRANSACTION_FLUSH_MAX = 1000
+
+# Segundos que se reutiliza el saldo mostrado por el botón "My Credits"
+CREDITS_CACHE_TTL = 2
+# Segundos que se reutilizan los contadores globales de /stats
+BOT_STATS_TTL = 5
+# Mensajes de menú recordados para no repetir ediciones idénticas
+MENU_CACHE_SIZE = 1000
+# Sentencias preparadas que sqlite3 guarda por conexión (por defecto 128)
+SQLITE_CACHED_STATEMENTS = 256
+# Resultados de búsqueda recordados hasta que cambian los archivos
+QUERY_CACHE_SIZE = 1024
+# Líneas guardadas entre todas las consultas; un resultado de más de
+# QUERY_CACHE_MAX_RESULT líneas (los que van en .zip) no se guarda
+QUERY_CACHE_MAX_LINES = 100000
+QUERY_CACHE_MAX_RESULT = 5000
+# /search sin elegir formato: se olvida pasado este tiempo (segundos)
+PENDING_SEARCH_TTL = 300
+PENDING_SEARCH_MAX = 10000
+
+# Updates que se procesan a la vez entre chats distintos (los de un mismo
+# chat van de uno en uno: ChatSerialUpdateProcessor). Una subida o búsqueda
+# larga no deja esperando al resto de usuarios
+CONCURRENT_UPDATES = 64
+
 PORT = int(os.getenv('PORT', 10000))
 
 BASE_DIR = "bot_data"
 DATA_DIR = os.path.join(BASE_DIR, "ulp_files")
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 DB_PATH = os.path.join(BASE_DIR, "bot.db")
+INDEX_DB_PATH = os.path.join(BASE_DIR, "search_index.db")
 
 for directory in [BASE_DIR, DATA_DIR, UPLOAD_DIR]:
     os.makedirs(directory, exist_ok=True)
@@ -68,237 +143,996 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # ============================================================================
-# FLASK APP
+# HEALTH SERVER
+# ============================================================================
+
+def _http_response(status: str, payload: Dict) -> bytes:
+    body = json.dumps(payload).encode('utf-8')
+    head = (
+        f"HTTP/1.1 {status}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n"
+    )
+    return head.encode('ascii') + body
+
+# Las respuestas no cambian: se generan una vez al importar
+HTTP_RESPONSES = {
+    '/': _http_response('200 OK', {"status": "online", "bot": BOT_NAME, "owner": BOT_OWNER}),
+    '/health': _http_response('200 OK', {"status": "healthy"}),
+}
+HTTP_NOT_FOUND = _http_response('404 Not Found', {"error": "not found"})
+# Segundos para recibir la petición completa antes de cerrar la conexión
+HTTP_TIMEOUT = 5
+
+async def handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """HTTP mínimo para el health check de Render, en el bucle del bot"""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HTTP_TIMEOUT)
+        parts = head.split(b'\r\n', 1)[0].split()
+        path = parts[1].split(b'?', 1)[0].decode('latin-1') if len(parts) >= 2 else ''
+        
+        response = HTTP_RESPONSES.get(path, HTTP_NOT_FOUND)
+        if parts[:1] == [b'HEAD']:
+            response = response[:response.index(b'\r\n\r\n') + 4]
+        
+        writer.write(response)
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def start_health_server(application: Application):
+    application.bot_data['health_server'] = await asyncio.start_server(handle_http, '0.0.0.0', PORT)
+    logger.info(f"🌐 Health server on port {PORT}")
+
+async def stop_health_server(application: Application):
+    server = application.bot_data.pop('health_server', None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+
+# ============================================================================
+# DNI VALIDATION
+# ============================================================================
+
+# Letra de control del DNI: índice = número % 23
+_DNI_LETTERS = b"TRWAGMYFPDXBNJZSQVHLCKE"
+
+# Primer campo de un combo DNI:password
+DNI_PATTERN = re.compile(r'\b[0-9]{8}[A-Z]\b')
+
+# Argumentos de /dni y /email (se comprueban antes de recorrer archivos)
+DNI_QUERY_PATTERN = re.compile(r'[0-9]{8}[A-Z]')
+EMAIL_QUERY_PATTERN = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
+
+def is_valid_dni(dni: str) -> bool:
+    """Comprueba formato (8 dígitos + letra) y letra de control en una pasada"""
+    if len(dni) != 9 or not dni.isascii():
+        return False
+    b = dni.encode('ascii')
+    n = 0
+    for c in b[:8]:
+        d = c - 48
+        if not 0 <= d <= 9:
+            return False
+        n = n * 10 + d
+    # & 0xDF pasa la letra a mayúscula sin llamar a upper()
+    return _DNI_LETTERS[n % 23] == b[8] & 0xDF
+
+# ============================================================================
+# HELPERS
 # ============================================================================
 
-app = Flask(__name__)
+# Tabla para str.translate: una sola pasada en C en vez de tres replace()
+_HTML_ESCAPE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
 
-@app.route('/')
-def home():
-    return jsonify({"status": "online", "bot": BOT_NAME, "owner": BOT_OWNER})
+# Lo que no puede ir en el nombre de un .txt de resultados
+_FILENAME_UNSAFE = re.compile(r'[^\w.@-]')
+
+def seconds_until_reset(now: datetime) -> int:
+    """Segundos hasta el próximo reset diario, con aritmética entera"""
+    elapsed = now.hour * 3600 + now.minute * 60 + now.second
+    return (RESET_HOUR * 3600 - elapsed) % 86400 or 86400
+
+def admin_only(handler):
+    """Corta el handler con 'Admins only' si el usuario no es admin"""
+    @wraps(handler)
+    async def wrapper(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user.id not in ADMIN_IDS:
+            await update.effective_message.reply_text("❌ Admins only.")
+            return
+        return await handler(self, update, context)
+    return wrapper
 
-@app.route('/health')
-def health():
-    return jsonify({"status": "healthy"})
+class ChatSerialUpdateProcessor(BaseUpdateProcessor):
+    """Updates de chats distintos en paralelo; los de un mismo chat en orden.
+    
+    ConversationHandler no admite dos updates de la misma conversación a la
+    vez, y edit_menu recuerda el último texto de cada mensaje: ambos quedan
+    como sin concurrencia dentro de cada chat. Lo demás que comparten los
+    handlers (pending_searches, la caché de menús) solo se toca en el bucle
+    de eventos y sin await entre leer y escribir.
+    """
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # chat_id -> [lock, updates de ese chat en curso o esperando]
+        self._chat_locks = {}
+    
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, 'effective_chat', None)
+        user = getattr(update, 'effective_user', None)
+        key = chat.id if chat else user.id if user else None
+        if key is None:
+            await coroutine
+            return
+        
+        entry = self._chat_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[key]
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+class TokenBucket:
+    """Limitador de ritmo: hasta rate operaciones por segundo (ráfaga = rate)"""
+    
+    def __init__(self, rate: float):
+        self.base_rate = rate
+        self.rate = rate
+        self.tokens = rate
+        self.last = asyncio.get_running_loop().time()
+        self._restore_at = 0.0
+        self._lock = asyncio.Lock()
+    
+    def throttle(self, factor: float = 0.9, duration: float = 60):
+        """Baja el ritmo (p. ej. tras un RetryAfter) durante duration segundos"""
+        self.rate = max(1.0, self.rate * factor)
+        self._restore_at = asyncio.get_running_loop().time() + duration
+    
+    async def acquire(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self.rate != self.base_rate and now >= self._restore_at:
+                    self.rate = self.base_rate
+                self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ExpiringDict:
+    """dict con caducidad (ttl segundos) y tamaño máximo.
+    
+    Con un ttl fijo el orden de inserción es también el de caducidad:
+    cada inserción descarta las entradas viejas desde el principio.
+    """
+    
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}  # clave -> (caduca, valor)
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        
+        now = time.monotonic()
+        while self._data:
+            oldest = next(iter(self._data))
+            if self._data[oldest][0] > now and len(self._data) <= self.maxsize:
+                break
+            del self._data[oldest]
+    
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        return entry[1]
+
+def parse_int(value: str) -> Optional[int]:
+    """Entero (con signo opcional) o None si el texto no es un número"""
+    digits = value[1:] if value[:1] in ('-', '+') else value
+    if digits.isascii() and digits.isdigit():
+        return int(value)
+    return None
+
+def remove_if_exists(path: str):
+    """os.remove sin comprobar antes con exists (una llamada en vez de dos)"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def open_sequential(file_path: str) -> BinaryIO:
+    """open(file_path, 'rb') avisando al kernel de que se leerá de principio a fin.
+    
+    Con POSIX_FADV_SEQUENTIAL el readahead es mayor. No se usa DONTNEED:
+    los archivos de datos son justo lo que conviene tener en caché.
+    """
+    f = open(file_path, 'rb')
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    return f
+
+# ============================================================================
+# SEARCH INDEX
+# ============================================================================
+
+# Host de la URL con la que empieza una línea ULP (url:login:pass), con o
+# sin esquema: "https://mail.google.com/...", "mail.google.com:...". Se
+# aplica a la línea en minúsculas, en bytes (índice) o str (escaneo)
+_URL_HOST = (
+    r'\s*(?:[a-z][a-z0-9+.-]*://)?'
+    r'([a-z0-9](?:[a-z0-9-]*[a-z0-9])?(?:\.[a-z0-9](?:[a-z0-9-]*[a-z0-9])?)+)'
+    r'(?![a-z0-9_.@-])'
+)
+URL_HOST_PATTERN = re.compile(_URL_HOST.encode('ascii'))
+URL_HOST_PATTERN_STR = re.compile(_URL_HOST)
+
+# Dominio de un email de la línea ("bob@gmail.com"), en el login de una
+# línea ULP o en un combo email:pass
+_EMAIL_DOMAIN = (
+    r'@([a-z0-9](?:[a-z0-9-]*[a-z0-9])?(?:\.[a-z0-9](?:[a-z0-9-]*[a-z0-9])?)+)'
+    r'(?![a-z0-9_@-])'
+)
+EMAIL_DOMAIN_PATTERN = re.compile(_EMAIL_DOMAIN.encode('ascii'))
+EMAIL_DOMAIN_PATTERN_STR = re.compile(_EMAIL_DOMAIN)
+
+def line_hosts(line_lower):
+    """Host de la URL y dominios de email de una línea en minúsculas (bytes o str)"""
+    if isinstance(line_lower, bytes):
+        url_pattern, email_pattern = URL_HOST_PATTERN, EMAIL_DOMAIN_PATTERN
+    else:
+        url_pattern, email_pattern = URL_HOST_PATTERN_STR, EMAIL_DOMAIN_PATTERN_STR
+    hosts = set(email_pattern.findall(line_lower))
+    match = url_pattern.match(line_lower)
+    if match:
+        hosts.add(match.group(1))
+    return hosts
+
+# Consultas que se pueden resolver con el índice
+DOMAIN_QUERY_PATTERN = re.compile(r'[a-z0-9](?:[a-z0-9-]*[a-z0-9])?(?:\.[a-z0-9](?:[a-z0-9-]*[a-z0-9])?)+')
+
+INDEX_BATCH_SIZE = 50000
+# Sube cuando cambia qué se indexa: al abrir un índice anterior se vacía
+# y los archivos se vuelven a indexar. 3: host de la URL y dominios de email
+INDEX_VERSION = 3
+
+class SearchIndex:
+    """Índice invertido host → (archivo, offset, longitud) en SQLite.
+    
+    Cada línea se indexa por el host de su URL y por el dominio de sus
+    emails (line_hosts). Los hosts se guardan invertidos ("com.gmail.mail")
+    para que un dominio y todos sus subdominios sean un único rango del índice.
+    """
+    
+    def __init__(self, db_path: str = INDEX_DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self.init_database()
+    
+    def get_connection(self):
+        """Una conexión por hilo (el indexado corre en segundo plano)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, cached_statements=SQLITE_CACHED_STATEMENTS)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            self._local.conn = conn
+        return conn
+    
+    def init_database(self):
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS files (
+                    file_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT UNIQUE NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL
+                )
+            ''')
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS postings (
+                    token TEXT NOT NULL,
+                    file_id INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    length INTEGER NOT NULL
+                )
+            ''')
+            
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_postings_token ON postings(token, file_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_postings_file ON postings(file_id)')
+            
+            if cursor.execute('PRAGMA user_version').fetchone()[0] < INDEX_VERSION:
+                cursor.execute('DELETE FROM postings')
+                cursor.execute('DELETE FROM files')
+                cursor.execute(f'PRAGMA user_version = {INDEX_VERSION}')
+            
+            # Filtros de Bloom de versiones anteriores: se saturaban con
+            # cualquier archivo real y no descartaban nada
+            cursor.execute('DROP TABLE IF EXISTS blooms')
+    
+    @staticmethod
+    def reverse_host(host: str) -> str:
+        return '.'.join(reversed(host.split('.')))
+    
+    def lookup_file(self, file_path: str) -> Optional[int]:
+        """file_id si el archivo está indexado y no ha cambiado desde entonces"""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        
+        row = self.get_connection().execute(
+            'SELECT file_id, size, mtime FROM files WHERE path = ?', (file_path,)
+        ).fetchone()
+        
+        if row and row[1] == st.st_size and row[2] == st.st_mtime:
+            return row[0]
+        return None
+    
+    def index_file(self, file_path: str) -> int:
+        """Indexa un archivo en una sola transacción; devuelve nº de postings"""
+        st = os.stat(file_path)
+        conn = self.get_connection()
+        total = 0
+        
+        with conn:
+            cursor = conn.cursor()
+            
+            row = cursor.execute('SELECT file_id FROM files WHERE path = ?', (file_path,)).fetchone()
+            if row:
+                file_id = row[0]
+                cursor.execute('DELETE FROM postings WHERE file_id = ?', (file_id,))
+                cursor.execute(
+                    'UPDATE files SET size = ?, mtime = ? WHERE file_id = ?',
+                    (st.st_size, st.st_mtime, file_id)
+                )
+            else:
+                cursor.execute(
+                    'INSERT INTO files (path, size, mtime) VALUES (?, ?, ?)',
+                    (file_path, st.st_size, st.st_mtime)
+                )
+                file_id = cursor.lastrowid
+            
+            batch = []
+            offset = 0
+            with open_sequential(file_path) as f:
+                for raw in f:
+                    line = raw.rstrip(b'\r\n')
+                    for host in line_hosts(line.lower()):
+                        token = self.reverse_host(host.decode('ascii'))
+                        batch.append((token, file_id, offset, len(line)))
+                    offset += len(raw)
+                    
+                    if len(batch) >= INDEX_BATCH_SIZE:
+                        cursor.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)', batch)
+                        total += len(batch)
+                        batch = []
+            
+            if batch:
+                cursor.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)', batch)
+                total += len(batch)
+        
+        logger.info(f"🗂️ Indexed {os.path.basename(file_path)}: {total} postings")
+        return total
+    
+    def find(self, file_id: int, domain: str) -> List[Tuple[int, int]]:
+        """(offset, longitud) de las líneas cuya URL es del dominio o de un subdominio"""
+        token = self.reverse_host(domain)
+        prefix = token + '.'
+        
+        # '/' es el carácter siguiente a '.': el rango cubre token y token.*
+        rows = self.get_connection().execute(
+            'SELECT token, offset, length FROM postings '
+            'WHERE token >= ? AND token < ? AND file_id = ? ORDER BY offset',
+            (token, token + '/', file_id)
+        )
+        
+        spans = []
+        last_offset = -1
+        for row_token, offset, length in rows:
+            if offset == last_offset:
+                continue
+            if row_token == token or row_token.startswith(prefix):
+                spans.append((offset, length))
+                last_offset = offset
+        return spans
 
 # ============================================================================
 # SEARCH ENGINE - SIN LÍMITES
 # ============================================================================
 
+class MmapCache:
+    """mmaps de solo lectura reutilizados entre consultas.
+    
+    Cada entrada se valida con (inodo, tamaño, mtime): si el archivo se
+    reemplaza se vuelve a mapear. Las entradas viejas no se cierran a mano;
+    se liberan cuando ninguna búsqueda en curso las está usando.
+    """
+    
+    def __init__(self, advice: Optional[int] = None):
+        self.advice = advice
+        self._maps = {}
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+    
+    def get(self, file_path: str) -> Optional[mmap.mmap]:
+        """mmap del archivo, o None si está vacío (no se puede mapear)"""
+        if time.monotonic() - self._last_prune > MMAP_PRUNE_INTERVAL:
+            self.prune()
+        
+        st = os.stat(file_path)
+        key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        
+        with self._lock:
+            entry = self._maps.get(file_path)
+        if entry and entry[0] == key:
+            return entry[1]
+        
+        if st.st_size == 0:
+            return None
+        
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        if self.advice is not None:
+            mm.madvise(self.advice)
+        
+        with self._lock:
+            self._maps[file_path] = (key, mm)
+        return mm
+    
+    def discard(self, file_path: str):
+        with self._lock:
+            self._maps.pop(file_path, None)
+    
+    def prune(self):
+        """Suelta los mapas cuyo archivo ya no existe o es otro (inodo, tamaño, mtime).
+        
+        Los procesos del pool no reciben discard(): sin esto mantendrían
+        mapeado un archivo borrado y su espacio en disco no se liberaría.
+        """
+        self._last_prune = time.monotonic()
+        with self._lock:
+            entries = list(self._maps.items())
+        
+        stale = []
+        for file_path, (key, _) in entries:
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                stale.append(file_path)
+                continue
+            if (st.st_ino, st.st_size, st.st_mtime_ns) != key:
+                stale.append(file_path)
+        
+        with self._lock:
+            for file_path in stale:
+                self._maps.pop(file_path, None)
+
+# Escaneos completos (en los procesos del pool): lectura secuencial
+_SCAN_MMAPS = MmapCache(getattr(mmap, 'MADV_SEQUENTIAL', None))
+
+# Procesos del pool sin fork: el bot ya tiene hilos (indexado, escritor de
+# transacciones) y conexiones SQLite, y un fork podría copiar un lock tomado
+_POOL_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
 class SearchEngine:
-    def __init__(self, data_dir: str = DATA_DIR):
+    def __init__(self, data_dir: str = DATA_DIR, index: SearchIndex = None):
         self.data_dir = data_dir
+        self.index = index or SearchIndex()
+        # Los procesos se crean con el primer submit, no aquí
+        self._pool = ProcessPoolExecutor(max_workers=SEARCH_WORKERS, mp_context=_POOL_CONTEXT)
+        # Lecturas puntuales de líneas encontradas con el índice
+        self._read_mmaps = MmapCache(getattr(mmap, 'MADV_RANDOM', None))
         self.data_files = []
+        # ruta -> (mtime, tamaño) de la última lectura de DATA_DIR
+        self._files_by_path = {}
+        self.recent_files = []
+        # (tipo, texto, límite) -> (generación, resultado); la generación
+        # sube cada vez que cambian los archivos o el índice
+        self._db_gen = 0
+        self._query_cache = OrderedDict()
+        self._query_cache_lines = 0
+        self._query_lock = threading.Lock()
         self.load_all_data()
     
     def load_all_data(self):
-        self.data_files = glob.glob(os.path.join(self.data_dir, "*.txt"))
-        logger.info(f"📂 Loaded {len(self.data_files)} files")
+        """Relee DATA_DIR aplicando solo lo que cambió desde la última vez"""
+        files = {}
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if os.path.splitext(entry.name)[1].lower() not in DATA_FILE_EXTS or not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                files[entry.path] = (st.st_mtime, st.st_size)
+        
+        previous = self._files_by_path
+        changed = [path for path, info in previous.items() if files.get(path) != info]
+        added = files.keys() - previous.keys()
+        for file_path in changed:
+            self._read_mmaps.discard(file_path)
+        
+        self._files_by_path = files
+        self.data_files = list(files)
+        self.recent_files = self._collect_recent_files()
+        self._bump_generation()
+        
+        if previous:
+            logger.info(
+                f"📂 Loaded {len(self.data_files)} files "
+                f"(+{len(added)}, changed/removed {len(changed)})"
+            )
+        else:
+            logger.info(f"📂 Loaded {len(self.data_files)} files")
     
-    def search_domain(self, domain: str, max_results: int = None) -> Tuple[int, List[str]]:
-        """Busca dominio SIN LÍMITE"""
-        results = []
-        domain_lower = domain.lower()
-        
-        for file_path in self.data_files:
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        
-                        if domain_lower in line.lower():
-                            results.append(line)
-                        
-                        if max_results and len(results) >= max_results:
-                            break
-            
-            except Exception as e:
-                logger.error(f"Error in {file_path}: {e}")
+    def _bump_generation(self):
+        with self._query_lock:
+            self._db_gen += 1
+            self._query_cache.clear()
+            self._query_cache_lines = 0
+    
+    def _cached(self, kind: str, needle: str, max_results: Optional[int], search):
+        """Devuelve el resultado guardado para la consulta o la ejecuta"""
+        key = (kind, needle, max_results)
+        with self._query_lock:
+            gen = self._db_gen
+            hit = self._query_cache.get(key)
+            if hit and hit[0] == gen:
+                self._query_cache.move_to_end(key)
+                return hit[1]
+        
+        result = search()
+        lines = len(result[1])
+        if lines > QUERY_CACHE_MAX_RESULT:
+            return result
+        
+        with self._query_lock:
+            # Si los archivos cambiaron durante la búsqueda no se guarda
+            if gen == self._db_gen:
+                old = self._query_cache.pop(key, None)
+                if old:
+                    self._query_cache_lines -= len(old[1][1])
+                self._query_cache[key] = (gen, result)
+                self._query_cache_lines += lines
+                while (len(self._query_cache) > QUERY_CACHE_SIZE
+                       or self._query_cache_lines > QUERY_CACHE_MAX_LINES):
+                    _, (_, evicted) = self._query_cache.popitem(last=False)
+                    self._query_cache_lines -= len(evicted[1])
+        return result
+    
+    def _collect_recent_files(self, limit: int = 5) -> List[Dict]:
+        """Últimos archivos añadidos (se calcula al recargar, no en cada /stats)"""
+        files = sorted(
+            ((mtime, size, file_path) for file_path, (mtime, size) in self._files_by_path.items()),
+            reverse=True
+        )
+        return [
+            {
+                "name": os.path.basename(file_path),
+                "size": size,
+                "modified": datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M')
+            }
+            for mtime, size, file_path in files[:limit]
+        ]
+    
+    @staticmethod
+    def _needle_pattern(text: str) -> "re.Pattern[bytes]":
+        """Regex de bytes para un texto literal, en minúsculas.
+        
+        _scan_file busca sobre bloques ya pasados a minúsculas: sin
+        IGNORECASE re usa su búsqueda rápida de literales (~10x).
+        """
+        return re.compile(SearchEngine._needle_regex(text))
+    
+    @staticmethod
+    def _needle_regex(text: str) -> bytes:
+        """Fuente de la regex de _needle_pattern.
+        
+        bytes.lower() solo cambia ASCII, así que cada carácter no ASCII se
+        busca en todas sus formas que str.lower() deja en él (ñ|Ñ): el
+        resultado es el mismo que query.lower() in line.lower(). Un texto
+        solo ASCII queda como literal.
+        """
+        text = text.lower()
+        if text.isascii():
+            return re.escape(text.encode('ascii'))
+        
+        parts = []
+        for ch in text:
+            if ch.isascii():
+                parts.append(re.escape(ch.encode('ascii')))
                 continue
-        
-        return len(results), results
+            forms = dict.fromkeys(
+                form.encode('utf-8') for form in (ch, ch.upper(), ch.title())
+                if len(form) == 1 and form.lower() == ch
+            )
+            if len(forms) == 1:
+                parts.append(re.escape(next(iter(forms))))
+            else:
+                parts.append(b'(?:' + b'|'.join(map(re.escape, forms)) + b')')
+        return b''.join(parts)
     
-    def search_email(self, email: str, max_results: int = None) -> Tuple[int, List[str]]:
+    @staticmethod
+    def _scan_file(file_path: str, pattern: "re.Pattern[bytes]", accept=None,
+                   limit: int = None) -> List[str]:
+        """Líneas de un archivo que contienen pattern.
+        
+        Recorre el archivo mapeado en memoria buscando directamente sobre
+        los bytes; solo se decodifican las líneas que casan. pattern debe
+        estar en minúsculas (_needle_pattern). accept filtra la línea ya
+        decodificada.
+        """
         results = []
-        email_lower = email.lower()
-        
-        for file_path in self.data_files:
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        
-                        if email_lower in line.lower():
-                            results.append(line)
-                        
-                        if max_results and len(results) >= max_results:
-                            break
+        mm = _SCAN_MMAPS.get(file_path)
+        if mm is None:
+            return results
+        
+        # Bloques terminados en fin de línea: una línea nunca queda partida.
+        # bytes.lower() solo cambia ASCII (las mayúsculas no ASCII las cubre
+        # _needle_regex) y no cambia la longitud: las posiciones valen para mm
+        size = len(mm)
+        block_start = 0
+        while block_start < size:
+            block_end = mm.find(b'\n', block_start + SCAN_BLOCK_SIZE)
+            block_end = size if block_end == -1 else block_end + 1
+            block = mm[block_start:block_end].lower()
+            
+            pos = 0
+            while True:
+                match = pattern.search(block, pos)
+                if match is None:
+                    break
+                
+                start = block.rfind(b'\n', 0, match.start()) + 1
+                end = block.find(b'\n', match.end())
+                if end == -1:
+                    end = len(block)
+                pos = end + 1
+                
+                line = mm[block_start + start:block_start + end].decode('utf-8', errors='ignore').strip()
+                if line and (accept is None or accept(line)):
+                    results.append(line)
+                    if limit and len(results) >= limit:
+                        return results
             
-            except Exception as e:
-                logger.error(f"Error in {file_path}: {e}")
-                continue
+            block_start = block_end
         
-        return len(results), results
+        return results
     
-    def search_login(self, login: str, max_results: int = None) -> Tuple[int, List[str]]:
+    @staticmethod
+    def _collect(jobs: List[Tuple[str, object]], max_results: int = None) -> Tuple[int, List[str]]:
+        """Junta resultados por archivo en orden; jobs son listas o Futures.
+        
+        Al llegar a max_results se cancelan los escaneos que aún no empezaron.
+        """
         results = []
-        login_lower = login.lower()
         
-        for file_path in self.data_files:
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        
-                        if ':' in line:
-                            parts = line.split(':')
-                            if len(parts) >= 2:
-                                if login_lower in parts[0].lower():
-                                    results.append(line)
-                        
-                        if max_results and len(results) >= max_results:
-                            break
+        for file_path, job in jobs:
+            if max_results and len(results) >= max_results:
+                if isinstance(job, Future):
+                    job.cancel()
+                continue
             
+            try:
+                lines = job.result() if isinstance(job, Future) else job
             except Exception as e:
                 logger.error(f"Error in {file_path}: {e}")
                 continue
+            
+            results.extend(lines)
         
+        if max_results:
+            del results[max_results:]
         return len(results), results
     
-    def search_password(self, password: str, max_results: int = None) -> Tuple[int, List[str]]:
-        results = []
-        password_lower = password.lower()
-        
-        for file_path in self.data_files:
+    def _scan(self, text: str, accept=None, max_results: int = None) -> Tuple[int, List[str]]:
+        """Busca text en todos los archivos en el pool de procesos (bloquea hasta el final)"""
+        pattern = self._needle_pattern(text)
+        jobs = [
+            (file_path, self._pool.submit(self._scan_file, file_path, pattern, accept, max_results))
+            for file_path in self.data_files
+        ]
+        return self._collect(jobs, max_results)
+    
+    def index_pending_files(self):
+        """Indexa los archivos que aún no están en el índice (o han cambiado)"""
+        indexed = 0
+        for file_path in list(self.data_files):
+            if self.index.lookup_file(file_path) is not None:
+                continue
             try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        
-                        if password_lower in line.lower():
-                            results.append(line)
-                        
-                        if max_results and len(results) >= max_results:
-                            break
-            
+                self.index.index_file(file_path)
+                indexed += 1
             except Exception as e:
-                logger.error(f"Error in {file_path}: {e}")
-                continue
+                logger.error(f"Error indexing {file_path}: {e}")
         
-        return len(results), results
+        # search_domain resuelve distinto los archivos indexados
+        if indexed:
+            self._bump_generation()
     
-    def search_dni(self, dni: str, max_results: int = None) -> Tuple[int, List[str]]:
-        """Busca DNI español en formato DNI:password"""
-        results = []
-        dni_clean = dni.upper().replace(' ', '').replace('-', '')
+    def _read_lines(self, file_path: str, spans: List[Tuple[int, int]]) -> List[str]:
+        mm = self._read_mmaps.get(file_path)
+        if mm is None:
+            return []
+        lines = (mm[offset:offset + length].decode('utf-8', errors='ignore').strip()
+                 for offset, length in spans)
+        return [line for line in lines if line]
+    
+    def search_domain(self, domain: str, max_results: int = None) -> Tuple[int, List[str]]:
+        """Busca dominio SIN LÍMITE.
+        
+        Un dominio completo devuelve las líneas cuya URL o algún email es de
+        ese dominio o de un subdominio (_has_host): con el índice si el
+        archivo ya está indexado y recorriéndolo si no, con el mismo resultado. Una
+        consulta parcial ("gmail") se busca como texto en toda la línea.
+        """
+        return self._cached('domain', domain.lower(), max_results,
+                            partial(self._search_domain, domain, max_results))
+    
+    def _search_domain(self, domain: str, max_results: int = None) -> Tuple[int, List[str]]:
+        domain_lower = domain.lower().strip('.')
+        if not DOMAIN_QUERY_PATTERN.fullmatch(domain_lower):
+            return self._scan(domain, max_results=max_results)
         
-        # Patrón para DNI español: 8 números + letra
-        dni_pattern = r'\b[0-9]{8}[A-Z]\b'
+        # El texto del dominio debe aparecer en la línea: filtro previo del escaneo
+        pattern = self._needle_pattern(domain_lower)
+        has_host = partial(self._has_host, domain_lower)
+        jobs = []
         
         for file_path in self.data_files:
             try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        
-                        # Buscar líneas que contengan el DNI
-                        if dni_clean in line.upper():
-                            # Verificar que sea un formato DNI:pass
-                            parts = line.split(':')
-                            if len(parts) >= 2:
-                                # El primer campo debe ser un DNI válido
-                                first_part = parts[0].upper().strip()
-                                if re.match(dni_pattern, first_part):
-                                    results.append(line)
-                        
-                        if max_results and len(results) >= max_results:
-                            break
-            
+                file_id = self.index.lookup_file(file_path)
+                if file_id is not None:
+                    job = self._read_lines(file_path, self.index.find(file_id, domain_lower))
+                else:
+                    job = self._pool.submit(self._scan_file, file_path, pattern, has_host, max_results)
             except Exception as e:
                 logger.error(f"Error in {file_path}: {e}")
                 continue
+            jobs.append((file_path, job))
         
-        return len(results), results
+        return self._collect(jobs, max_results)
     
-    def search_dni_by_domain(self, domain: str, max_results: int = None) -> Tuple[int, List[str]]:
-        """Busca combos DNI:password que contengan un dominio específico"""
-        results = []
-        domain_lower = domain.lower()
+    @staticmethod
+    def _has_host(domain_lower: str, line: str) -> bool:
+        """La URL o un email de la línea es de domain_lower o un subdominio (lo mismo que SearchIndex.find)"""
+        return any(host == domain_lower or host.endswith('.' + domain_lower)
+                   for host in line_hosts(line.lower()))
+    
+    def search_many(self, needles: List[str], max_results: int = None) -> Dict[str, List[str]]:
+        """Busca varios textos con una sola pasada por archivo.
+        
+        Las búsquedas se combinan en una alternancia de regex; cada línea
+        candidata se reparte después entre los textos que contiene.
+        """
+        needles = list(dict.fromkeys(n.lower() for n in needles if n))
+        results = {needle: [] for needle in needles}
+        if not needles:
+            return results
+        
+        # Los más largos primero: la alternancia prueba en orden
+        alternation = b'|'.join(
+            self._needle_regex(n) for n in sorted(needles, key=len, reverse=True)
+        )
+        pattern = re.compile(alternation)
         
-        # Patrón para DNI español
-        dni_pattern = r'\b[0-9]{8}[A-Z]\b'
+        jobs = [
+            (file_path, self._pool.submit(self._scan_file, file_path, pattern))
+            for file_path in self.data_files
+        ]
         
-        for file_path in self.data_files:
+        for file_path, job in jobs:
             try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        
-                        # Verificar que sea DNI:password
-                        parts = line.split(':')
-                        if len(parts) >= 2:
-                            first_part = parts[0].upper().strip()
-                            if re.match(dni_pattern, first_part):
-                                # Buscar el dominio en toda la línea
-                                if domain_lower in line.lower():
-                                    results.append(line)
-                        
-                        if max_results and len(results) >= max_results:
-                            break
-            
+                lines = job.result()
             except Exception as e:
                 logger.error(f"Error in {file_path}: {e}")
                 continue
+            
+            for line in lines:
+                line_lower = line.lower()
+                for needle in needles:
+                    found = results[needle]
+                    if needle in line_lower and not (max_results and len(found) >= max_results):
+                        found.append(line)
         
-        return len(results), results
+        return results
+    
+    def search_email(self, email: str, max_results: int = None) -> Tuple[int, List[str]]:
+        return self._cached('email', email.lower(), max_results,
+                            partial(self._scan, email, None, max_results))
+    
+    def search_login(self, login: str, max_results: int = None) -> Tuple[int, List[str]]:
+        # partial de un staticmethod: se puede enviar a los procesos del pool
+        in_login_field = partial(self._in_login_field, login.lower())
+        return self._cached('login', login.lower(), max_results,
+                            partial(self._scan, login, in_login_field, max_results))
+    
+    @staticmethod
+    def _in_login_field(login_lower: str, line: str) -> bool:
+        # partition: sin lista intermedia y una sola búsqueda de ':'
+        head, sep, _ = line.partition(':')
+        return bool(sep) and login_lower in head.lower()
+    
+    def search_password(self, password: str, max_results: int = None) -> Tuple[int, List[str]]:
+        return self._cached('password', password.lower(), max_results,
+                            partial(self._scan, password, None, max_results))
+    
+    @staticmethod
+    def _is_dni_combo(line: str) -> bool:
+        """Formato DNI:password (el primer campo debe ser un DNI)"""
+        parts = line.split(':', 1)
+        return len(parts) == 2 and DNI_PATTERN.match(parts[0].upper().strip()) is not None
+    
+    def search_dni(self, dni: str, max_results: int = None) -> Tuple[int, List[str]]:
+        """Busca DNI español en formato DNI:password"""
+        dni_clean = dni.upper().replace(' ', '').replace('-', '')
+        return self._cached('dni', dni_clean, max_results,
+                            partial(self._scan, dni_clean, self._is_dni_combo, max_results))
+    
+    def search_dni_by_domain(self, domain: str, max_results: int = None) -> Tuple[int, List[str]]:
+        """Busca combos DNI:password que contengan un dominio específico"""
+        # El dominio se busca sobre los bytes; la validación del DNI solo
+        # se hace sobre las líneas candidatas
+        return self._cached('dni_domain', domain.lower(), max_results,
+                            partial(self._scan, domain, self._is_dni_combo, max_results))
     
     def get_stats(self) -> Dict:
         return {
             "total_files": len(self.data_files),
-            "recent_files": []
+            "recent_files": self.recent_files
         }
     
-    def add_data_file(self, file_path: str) -> Tuple[bool, str]:
+    def _register_file(self, dest_path: str):
+        self.load_all_data()
+        
+        # Si falla el índice el archivo sigue siendo buscable recorriéndolo
+        try:
+            self.index.index_file(dest_path)
+        except Exception as e:
+            logger.error(f"Error indexing {dest_path}: {e}")
+        self._bump_generation()
+    
+    def add_data_fileobj(self, fileobj: BinaryIO, filename: str) -> Tuple[bool, str, int]:
+        """Copia un archivo abierto (p. ej. una descarga) a DATA_DIR y lo indexa.
+        
+        Se escribe a un .part y se renombra: una búsqueda nunca ve el
+        archivo a medias, y volver a subir un nombre existente lo reemplaza. Las líneas se cuentan sobre los mismos bloques
+        que se copian; devuelve (ok, nombre o error, líneas).
+        """
+        filename = os.path.basename(filename)
+        dest_path = os.path.join(self.data_dir, filename)
+        part_path = dest_path + '.part'
         try:
-            import shutil
-            filename = os.path.basename(file_path)
-            dest_path = os.path.join(self.data_dir, filename)
-            shutil.copy2(file_path, dest_path)
-            self.load_all_data()
-            return True, filename
+            fileobj.seek(0)
+            lines = 0
+            last = b'\n'
+            with open(part_path, 'wb') as out:
+                while chunk := fileobj.read(1 << 20):
+                    lines += chunk.count(b'\n')
+                    last = chunk[-1:]
+                    out.write(chunk)
+            if last != b'\n':
+                lines += 1
+            
+            os.replace(part_path, dest_path)
+            self._register_file(dest_path)
+            return True, filename, lines
         except Exception as e:
-            return False, str(e)
+            remove_if_exists(part_path)
+            return False, str(e), 0
 
 # ============================================================================
 # CREDIT SYSTEM WITH REFERRALS
 # ============================================================================
 
+# Consultas repetidas en varios métodos: el mismo texto SQL reutiliza la
+# sentencia ya preparada en la caché de la conexión
+SQL_USER_CREDITS = 'SELECT daily_credits, extra_credits FROM users WHERE user_id = ?'
+SQL_INSERT_TRANSACTION = '''
+    INSERT INTO transactions (user_id, amount, type, description)
+    VALUES (?, ?, ?, ?)
+'''
+# Día de créditos en curso: cambia a RESET_HOUR (UTC), no a medianoche
+SQL_RESET_DATE = f"DATE('now', '-{RESET_HOUR} hours')"
+
 class CreditSystem:
     def __init__(self, db_path: str = DB_PATH):
         self.db_path = db_path
+        self._local = threading.local()
+        self._credits_cache = {}
+        self._bot_stats_cache = (0.0, None)
+        self._pending_transactions = queue.SimpleQueue()
+        # Avisa al hilo escritor; las filas no salen de la cola hasta escribirse
+        self._transactions_ready = threading.Event()
+        self._closed = False
+        # Una sola conexión de escritura para todo el proceso. RLock: un
+        # método que escribe puede llamar a otro que también escribe
+        self._write_lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            self.db_path, check_same_thread=False, cached_statements=SQLITE_CACHED_STATEMENTS
+        )
+        self._configure_connection(self._conn)
         self.init_database()
+        
+        threading.Thread(target=self._transaction_writer, daemon=True).start()
+        # close() vuelca antes todo lo pendiente
+        atexit.register(self.close)
     
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+    @staticmethod
+    def _configure_connection(conn: sqlite3.Connection):
         conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA cache_size=-64000')
+        conn.execute('PRAGMA mmap_size=268435456')
+        conn.execute('PRAGMA temp_store=MEMORY')
+    
+    @contextmanager
+    def get_connection(self):
+        """Conexión de escritura compartida: confirma al salir, o deshace si hay error"""
+        with self._write_lock, self._conn:
+            yield self._conn
+    
+    def close(self):
+        with self._write_lock:
+            if self._closed:
+                return
+            while self.flush_transactions():
+                pass
+            # Actualiza las estadísticas de las tablas consultadas en esta ejecución
+            self._conn.execute('PRAGMA optimize')
+            self._conn.close()
+            self._closed = True
+    
+    def get_read_connection(self):
+        """Conexión de solo lectura, una por hilo y reutilizada entre llamadas"""
+        conn = getattr(self._local, 'read_conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                f"file:{quote(self.db_path)}?mode=ro", uri=True,
+                cached_statements=SQLITE_CACHED_STATEMENTS
+            )
+            self._configure_connection(conn)
+            self._local.read_conn = conn
         return conn
     
     def init_database(self):
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
+            # WAL: los lectores no se bloquean mientras otro hilo escribe
+            cursor.execute('PRAGMA journal_mode=WAL')
+            
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
                     user_id INTEGER PRIMARY KEY,
@@ -316,6 +1150,11 @@ class CreditSystem:
                 )
             ''')
             
+            # /userslist: filtra por active y ordena por join_date sin ordenar en memoria
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS idx_users_active_join ON users(active, join_date DESC)'
+            )
+            
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS transactions (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -327,6 +1166,9 @@ class CreditSystem:
                 )
             ''')
             
+            # /stats cuenta las búsquedas por tipo sin recorrer la tabla
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tx_type ON transactions(type)')
+            
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS referrals (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -337,6 +1179,11 @@ class CreditSystem:
                 )
             ''')
             
+            # Recuento de referidos en /mystats y /referral
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals(referrer_id, referred_id)'
+            )
+            
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS daily_resets (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -358,6 +1205,56 @@ class CreditSystem:
             ''')
             
             conn.commit()
+            
+            # Estadísticas para el planificador (sqlite_stat1). Con
+            # analysis_limit ANALYZE solo muestrea cada índice: unos ms
+            cursor.execute('PRAGMA analysis_limit=400')
+            cursor.execute('ANALYZE')
+    
+    def log_transaction(self, user_id: int, amount: int, type_: str, description: str):
+        """Encola una fila de transactions; se inserta en el próximo lote"""
+        date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        self._pending_transactions.put((user_id, amount, type_, description, date))
+        self._transactions_ready.set()
+    
+    def flush_transactions(self) -> int:
+        """Inserta en una sola transacción lo encolado (hasta TRANSACTION_FLUSH_MAX filas).
+        
+        Sacar de la cola e insertar van bajo el lock de escritura: dos
+        volcados a la vez (hilo escritor y cierre) no desordenan las filas.
+        """
+        with self._write_lock:
+            if self._closed:
+                return 0
+            
+            rows = []
+            while len(rows) < TRANSACTION_FLUSH_MAX:
+                try:
+                    rows.append(self._pending_transactions.get_nowait())
+                except queue.Empty:
+                    break
+            
+            if rows:
+                with self.get_connection() as conn:
+                    conn.executemany('''
+                        INSERT INTO transactions (user_id, amount, type, description, date)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', rows)
+        return len(rows)
+    
+    def _transaction_writer(self):
+        while True:
+            # Espera a la primera fila y deja que se acumulen más. Se limpia
+            # el aviso antes de vaciar: lo que llegue mientras tanto lo vuelve
+            # a activar
+            self._transactions_ready.wait()
+            time.sleep(TRANSACTION_FLUSH_INTERVAL)
+            self._transactions_ready.clear()
+            try:
+                while self.flush_transactions():
+                    pass
+            except Exception as e:
+                logger.error(f"Error writing transactions: {e}")
     
     def generate_referral_code(self, user_id: int) -> str:
         code = f"REF{user_id}{random.randint(1000, 9999)}"
@@ -367,25 +1264,28 @@ class CreditSystem:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
-            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+            # Usuario existente (el caso habitual): una sola sentencia que
+            # refresca el nombre y devuelve la fila
+            cursor.execute('''
+                UPDATE users 
+                SET username = ?, first_name = ?
+                WHERE user_id = ?
+                RETURNING *
+            ''', (username, first_name, user_id))
             user = cursor.fetchone()
             
             if user:
-                self.check_daily_reset(user_id)
                 return dict(user)
             
             referral_code = self.generate_referral_code(user_id)
             
-            cursor.execute('''
+            cursor.execute(f'''
                 INSERT INTO users 
                 (user_id, username, first_name, daily_credits, referral_code, referred_by, last_reset)
-                VALUES (?, ?, ?, 2, ?, ?, DATE('now'))
+                VALUES (?, ?, ?, 2, ?, ?, {SQL_RESET_DATE})
             ''', (user_id, username, first_name, referral_code, referred_by))
             
-            cursor.execute('''
-                INSERT INTO transactions (user_id, amount, type, description)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, 2, 'daily_reset', '2 daily initial credits'))
+            cursor.execute(SQL_INSERT_TRANSACTION, (user_id, 2, 'daily_reset', '2 daily initial credits'))
             
             if referred_by:
                 cursor.execute('''
@@ -400,11 +1300,10 @@ class CreditSystem:
                     WHERE user_id = ?
                 ''', (REFERRAL_BONUS, referred_by))
                 
-                cursor.execute('''
-                    INSERT INTO transactions 
-                    (user_id, amount, type, description)
-                    VALUES (?, ?, ?, ?)
-                ''', (referred_by, REFERRAL_BONUS, 'referral_bonus', f'Referral bonus for user {user_id}'))
+                cursor.execute(
+                    SQL_INSERT_TRANSACTION,
+                    (referred_by, REFERRAL_BONUS, 'referral_bonus', f'Referral bonus for user {user_id}')
+                )
                 
                 cursor.execute('''
                     UPDATE referrals 
@@ -425,155 +1324,161 @@ class CreditSystem:
                 'referrals_count': 0
             }
     
-    def check_daily_reset(self, user_id: int):
+    def reset_daily_credits(self) -> int:
+        """Reset diario de todos los usuarios pendientes en una transacción.
+        
+        Idempotente: solo toca a quien no se ha reseteado en el día en curso,
+        así que sirve igual al arrancar que a RESET_HOUR. Devuelve cuántos.
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            cursor.execute(f'''
+                INSERT INTO transactions (user_id, amount, type, description)
+                SELECT user_id, 2, 'daily_reset', 'Daily reset to 2 credits'
+                FROM users WHERE last_reset IS NOT {SQL_RESET_DATE}
+            ''')
+            cursor.execute(f'''
+                UPDATE users 
+                SET daily_credits = 2,
+                    last_reset = {SQL_RESET_DATE}
+                WHERE last_reset IS NOT {SQL_RESET_DATE}
+            ''')
+            count = cursor.rowcount
             
-            cursor.execute(
-                'SELECT last_reset, daily_credits FROM users WHERE user_id = ?',
-                (user_id,)
-            )
-            result = cursor.fetchone()
-            
-            if result:
-                last_reset = result['last_reset']
-                today = datetime.now().date()
-                
-                if last_reset != str(today):
-                    cursor.execute('''
-                        UPDATE users 
-                        SET daily_credits = 2,
-                            last_reset = DATE('now')
-                        WHERE user_id = ?
-                    ''', (user_id,))
-                    
-                    cursor.execute('''
-                        INSERT INTO transactions (user_id, amount, type, description)
-                        VALUES (?, ?, ?, ?)
-                    ''', (user_id, 2, 'daily_reset', 'Daily reset to 2 credits'))
-                    
-                    conn.commit()
+            if count:
+                cursor.execute(f'''
+                    INSERT INTO daily_resets (reset_date, users_reset)
+                    VALUES ({SQL_RESET_DATE}, ?)
+                    ON CONFLICT(reset_date) DO UPDATE SET users_reset = users_reset + excluded.users_reset
+                ''', (count,))
+        
+        self._credits_cache.clear()
+        return count
     
-    def get_user_credits(self, user_id: int) -> int:
-        with self.get_connection() as conn:
+    def _read_credits(self, user_id: int) -> Tuple[int, int]:
+        """(total, diarios); (0, 0) si el usuario no existe"""
+        with self.get_read_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                'SELECT daily_credits, extra_credits FROM users WHERE user_id = ?',
-                (user_id,)
-            )
+            cursor.execute(SQL_USER_CREDITS, (user_id,))
             result = cursor.fetchone()
-            
-            if result:
-                self.check_daily_reset(user_id)
-                cursor.execute(
-                    'SELECT daily_credits, extra_credits FROM users WHERE user_id = ?',
-                    (user_id,)
-                )
-                result = cursor.fetchone()
-                return result['daily_credits'] + result['extra_credits']
-            
-            return 0
-    
-    def get_daily_credits_left(self, user_id: int) -> int:
-        self.check_daily_reset(user_id)
         
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT daily_credits FROM users WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            return result['daily_credits'] if result else 0
+        if not result:
+            return 0, 0
+        return result['daily_credits'] + result['extra_credits'], result['daily_credits']
+    
+    def get_credit_snapshot(self, user_id: int) -> Tuple[int, int]:
+        """(total, diarios); se reutiliza CREDITS_CACHE_TTL segundos.
+        
+        use_credits deja aquí el saldo que resulta, así que leerlo justo
+        después de una búsqueda no vuelve a consultar la base de datos.
+        """
+        now = time.monotonic()
+        cached = self._credits_cache.get(user_id)
+        if cached and now - cached[0] < CREDITS_CACHE_TTL:
+            return cached[1]
+        
+        snapshot = self._read_credits(user_id)
+        self._credits_cache[user_id] = (now, snapshot)
+        return snapshot
     
     def has_enough_credits(self, user_id: int) -> bool:
-        return self.get_user_credits(user_id) > 0
+        # Solo filtra: use_credits vuelve a comprobar el saldo al descontar
+        return self.get_credit_snapshot(user_id)[0] > 0
     
     def use_credits(self, user_id: int, search_type: str, query: str, results_count: int = 0):
+        """Descuenta un crédito (primero los diarios) sin leer antes el saldo.
+        
+        El WHERE de cada UPDATE hace la comprobación y RETURNING da el
+        saldo resultante.
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            self.check_daily_reset(user_id)
-            
-            cursor.execute(
-                'SELECT daily_credits, extra_credits FROM users WHERE user_id = ?',
-                (user_id,)
-            )
-            result = cursor.fetchone()
-            
-            if not result:
-                return False
-            
-            daily_credits = result['daily_credits']
-            extra_credits = result['extra_credits']
-            
-            if daily_credits > 0:
-                new_daily = daily_credits - 1
-                new_extra = extra_credits
-                credit_type = "daily"
-            elif extra_credits > 0:
-                new_daily = 0
-                new_extra = extra_credits - 1
-                credit_type = "extra"
-            else:
-                return False
-            
             cursor.execute('''
                 UPDATE users 
-                SET daily_credits = ?,
-                    extra_credits = ?,
+                SET daily_credits = daily_credits - 1,
                     total_searches = total_searches + 1
-                WHERE user_id = ?
-            ''', (new_daily, new_extra, user_id))
-            
-            cursor.execute('''
-                INSERT INTO transactions 
-                (user_id, amount, type, description)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, -1, 'search_used', f'{search_type}: {query} ({credit_type})'))
+                WHERE user_id = ? AND daily_credits > 0
+                RETURNING daily_credits, extra_credits
+            ''', (user_id,))
+            result = cursor.fetchone()
+            credit_type = "daily"
             
-            conn.commit()
-            return True
+            if result is None:
+                cursor.execute('''
+                    UPDATE users 
+                    SET extra_credits = extra_credits - 1,
+                        total_searches = total_searches + 1
+                    WHERE user_id = ? AND extra_credits > 0
+                    RETURNING daily_credits, extra_credits
+                ''', (user_id,))
+                result = cursor.fetchone()
+                credit_type = "extra"
+        
+        if result is None:
+            self._credits_cache.pop(user_id, None)
+            return False
+        
+        snapshot = (result['daily_credits'] + result['extra_credits'], result['daily_credits'])
+        self._credits_cache[user_id] = (time.monotonic(), snapshot)
+        self.log_transaction(user_id, -1, 'search_used', f'{search_type}: {query} ({credit_type})')
+        return True
     
     def add_credits_to_user(self, user_id: int, amount: int, admin_id: int, credit_type: str = 'extra') -> Tuple[bool, str]:
+        if not self.bulk_add_credits([(user_id, amount)], admin_id, credit_type):
+            return False, "User not found"
+        return True, f"✅ {amount} {credit_type} credits added"
+    
+    def bulk_add_credits(self, grants: List[Tuple[int, int]], admin_id: int, credit_type: str = 'extra') -> int:
+        """Suma créditos a varios usuarios [(user_id, cantidad)] en una sola transacción.
+        
+        Los usuarios que no existen se ignoran (sin fila en transactions);
+        devuelve cuántos se actualizaron.
+        """
+        column = 'extra_credits' if credit_type == 'extra' else 'daily_credits'
+        type_ = f'admin_add_{credit_type}'
+        description = f'{credit_type} credits added by admin {admin_id}'
+        
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            cursor.execute(
-                'SELECT extra_credits FROM users WHERE user_id = ?',
-                (user_id,)
+            cursor.executemany(
+                f'UPDATE users SET {column} = {column} + ? WHERE user_id = ?',
+                [(amount, user_id) for user_id, amount in grants]
             )
-            result = cursor.fetchone()
-            
-            if not result:
-                return False, "User not found"
+            updated = cursor.rowcount
             
-            if credit_type == 'extra':
-                cursor.execute(
-                    'UPDATE users SET extra_credits = extra_credits + ? WHERE user_id = ?',
-                    (amount, user_id)
-                )
-            else:
-                cursor.execute(
-                    'UPDATE users SET daily_credits = daily_credits + ? WHERE user_id = ?',
-                    (amount, user_id)
-                )
-            
-            cursor.execute('''
-                INSERT INTO transactions 
-                (user_id, amount, type, description)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, amount, f'admin_add_{credit_type}', f'{credit_type} credits added by admin {admin_id}'))
-            
-            conn.commit()
-            return True, f"✅ {amount} {credit_type} credits added"
+            cursor.executemany('''
+                INSERT INTO transactions (user_id, amount, type, description)
+                SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE user_id = ?)
+            ''', [(user_id, amount, type_, description, user_id) for user_id, amount in grants])
+        
+        for user_id, _ in grants:
+            self._credits_cache.pop(user_id, None)
+        return updated
     
     def get_user_info(self, user_id: int):
-        with self.get_connection() as conn:
+        with self.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
             result = cursor.fetchone()
             return dict(result) if result else None
     
+    def get_user_profile(self, user_id: int):
+        """Datos del usuario + referidos en una sola consulta"""
+        with self.get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT 
+                    u.*,
+                    u.daily_credits + u.extra_credits as total_credits,
+                    (SELECT COUNT(*) FROM referrals r WHERE r.referrer_id = u.user_id) as total_referred
+                FROM users u
+                WHERE u.user_id = ?
+            ''', (user_id,))
+            result = cursor.fetchone()
+            return dict(result) if result else None
+    
     def get_referral_stats(self, user_id: int):
-        with self.get_connection() as conn:
+        with self.get_read_connection() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -596,7 +1501,7 @@ class CreditSystem:
         return ""
     
     def validate_referral_code(self, code: str) -> Tuple[bool, Optional[int]]:
-        with self.get_connection() as conn:
+        with self.get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT user_id FROM users WHERE referral_code = ?', (code,))
             result = cursor.fetchone()
@@ -604,17 +1509,45 @@ class CreditSystem:
                 return True, result['user_id']
             return False, None
     
-    def get_all_users(self, limit: int = 50):
-        with self.get_connection() as conn:
+    def get_all_users(self, limit: int = 50, offset: int = 0) -> List[sqlite3.Row]:
+        """Una página de usuarios; solo las columnas que muestra /userslist"""
+        with self.get_read_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM users WHERE active = TRUE ORDER BY join_date DESC LIMIT ?', (limit,))
-            return [dict(row) for row in cursor.fetchall()]
+            cursor.execute('''
+                SELECT user_id, username, first_name, daily_credits, extra_credits, total_searches
+                FROM users WHERE active = TRUE ORDER BY join_date DESC LIMIT ? OFFSET ?
+            ''', (limit, offset))
+            # sqlite3.Row ya se indexa por nombre: no hace falta copiarlo a dict
+            return cursor.fetchall()
     
-    def get_all_users_for_broadcast(self):
-        with self.get_connection() as conn:
+    def get_user_count(self) -> int:
+        with self.get_read_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT user_id FROM users WHERE active = TRUE')
-            return [row['user_id'] for row in cursor.fetchall()]
+            cursor.execute('SELECT COUNT(*) as count FROM users WHERE active = TRUE')
+            return cursor.fetchone()['count']
+    
+    def iter_broadcast_user_ids(self, batch_size: int = BROADCAST_BATCH_SIZE):
+        """Recorre los usuarios activos por lotes (paginación por user_id)"""
+        last_id = None
+        while True:
+            with self.get_read_connection() as conn:
+                cursor = conn.cursor()
+                if last_id is None:
+                    cursor.execute(
+                        'SELECT user_id FROM users WHERE active = TRUE ORDER BY user_id LIMIT ?',
+                        (batch_size,)
+                    )
+                else:
+                    cursor.execute(
+                        'SELECT user_id FROM users WHERE active = TRUE AND user_id > ? ORDER BY user_id LIMIT ?',
+                        (last_id, batch_size)
+                    )
+                batch = [row['user_id'] for row in cursor.fetchall()]
+            
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1]
     
     def save_broadcast(self, admin_id: int, message: str, sent_to: int, failed_to: int):
         with self.get_connection() as conn:
@@ -626,26 +1559,253 @@ class CreditSystem:
             conn.commit()
     
     def get_bot_stats(self):
-        with self.get_connection() as conn:
+        """Todos los contadores de /stats en una sola consulta"""
+        with self.get_read_connection() as conn:
             cursor = conn.cursor()
-            
-            stats = {}
-            cursor.execute('SELECT COUNT(*) as count FROM users WHERE active = TRUE')
-            stats['total_users'] = cursor.fetchone()['count']
-            
-            cursor.execute('SELECT COUNT(*) as count FROM transactions WHERE type = "search_used"')
-            stats['total_searches'] = cursor.fetchone()['count']
-            
-            cursor.execute('SELECT SUM(daily_credits + extra_credits) as total FROM users')
-            stats['total_credits'] = cursor.fetchone()['total'] or 0
-            
-            cursor.execute('SELECT SUM(referrals_count) as total FROM users')
-            stats['total_referrals'] = cursor.fetchone()['total'] or 0
-            
-            cursor.execute('SELECT COUNT(*) as count FROM broadcasts')
-            stats['total_broadcasts'] = cursor.fetchone()['count']
-            
-            return stats
+            cursor.execute('''
+                SELECT 
+                    (SELECT COUNT(*) FROM users WHERE active = TRUE) as total_users,
+                    (SELECT COUNT(*) FROM transactions WHERE type = 'search_used') as total_searches,
+                    (SELECT COALESCE(SUM(daily_credits + extra_credits), 0) FROM users) as total_credits,
+                    (SELECT COALESCE(SUM(referrals_count), 0) FROM users) as total_referrals,
+                    (SELECT COUNT(*) FROM broadcasts) as total_broadcasts
+            ''')
+            return dict(cursor.fetchone())
+    
+    def get_bot_stats_cached(self, ttl: float = BOT_STATS_TTL) -> Dict:
+        """get_bot_stats reutilizado durante ttl segundos (panel admin)"""
+        now = time.monotonic()
+        cached_at, stats = self._bot_stats_cache
+        if stats is None or now - cached_at >= ttl:
+            stats = self.get_bot_stats()
+            self._bot_stats_cache = (now, stats)
+        return stats
+
+# ============================================================================
+# MESSAGE TEMPLATES
+# ============================================================================
+
+# Solo depende de constantes: se genera una vez al importar
+PRICE_MESSAGE = (
+    f"<b>💰 PRICE INFORMATION</b>\n\n"
+    f"<b>🎯 FREE SYSTEM:</b>\n"
+    f"🆓 <b>{MAX_FREE_CREDITS} free daily credits</b>\n"
+    f"🔄 <b>Resets at:</b> {RESET_HOUR}:00\n"
+    f"👥 <b>Referral bonus:</b> +{REFERRAL_BONUS} credits per friend\n\n"
+    
+    f"<b>💎 EXTRA CREDITS:</b>\n"
+    f"• Contact {BOT_OWNER} for extra credits\n"
+    f"• Extra credits are permanent\n"
+    f"• They don't reset daily\n\n"
+    
+    f"<b>📊 CREDIT VALUES:</b>\n"
+    f"🔍 <b>1 credit</b> = <b>1 search</b>\n"
+    f"📁 <b>Results delivery:</b>\n"
+    f"  • <5000 results → .txt file\n"
+    f"  • ≥5000 results → .zip file (split into parts)\n\n"
+    
+    f"<b>💡 TIPS:</b>\n"
+    f"• Use specific terms for better results\n"
+    f"• Invite friends to earn free credits\n"
+    f"• Contact {BOT_OWNER} for more credits\n\n"
+    
+    f"<i>Bot developed by {BOT_OWNER}</i>"
+)
+
+HELP_MESSAGE = (
+    f"<b>📚 {BOT_NAME} - COMPLETE HELP</b>\n\n"
+    
+    f"<b>🎯 FREE SYSTEM:</b>\n"
+    f"• Max {MAX_FREE_CREDITS} free credits\n"
+    f"• 1 credit = 1 search\n"
+    f"• Invite friends: +{REFERRAL_BONUS} credit per referral\n\n"
+    
+    f"<b>🔍 SEARCH COMMANDS:</b>\n"
+    f"<code>/search domain.com</code> - Search by domain\n"
+    f"  • email:pass (extracted) - SOLO email:password\n"
+    f"  • url:email:pass (full) - Línea completa\n"
+    f"<code>/email user@gmail.com</code> - Search by email\n"
+    f"<code>/login username</code> - Search by login\n"
+    f"<code>/pass password123</code> - Search by password\n"
+    f"<code>/dni 12345678A</code> - Search DNI:password by DNI number\n"
+    f"<code>/dni dominio.com</code> - Search DNI:password by domain\n\n"
+    
+    f"<b>💰 PERSONAL COMMANDS:</b>\n"
+    f"<code>/mycredits</code> - View your credits\n"
+    f"<code>/mystats</code> - Your statistics\n"
+    f"<code>/referral</code> - Your referral link\n"
+    f"<code>/price</code> - Price information\n\n"
+    
+    f"<b>📊 INFORMATION:</b>\n"
+    f"<code>/info</code> - Bot information\n"
+    f"<code>/help</code> - This help\n\n"
+    
+    f"<b>👑 ADMIN COMMANDS:</b>\n"
+    f"<code>/addcredits</code> - Add credits\n"
+    f"<code>/userinfo</code> - User information\n"
+    f"<code>/stats</code> - Statistics\n"
+    f"<code>/userslist</code> - List users\n"
+    f"<code>/multisearch</code> - Search several texts at once\n"
+    f"<code>/broadcast</code> - Send to all\n"
+    f"<code>/upload</code> - Upload ULP file\n\n"
+    
+    f"<b>📁 RESULTS DELIVERY:</b>\n"
+    f"• <5000 results → .txt file\n"
+    f"• ≥5000 results → .zip file (split into parts)\n"
+    f"• NO results shown in message\n\n"
+    
+    f"<b>💡 TIPS:</b>\n"
+    f"• Use specific terms for better results\n"
+    f"• Invite friends to earn free credits\n"
+    f"• Contact {BOT_OWNER} for more credits\n\n"
+    
+    f"<i>Bot developed by {BOT_OWNER}</i>"
+)
+
+WELCOME_TEMPLATE = (
+    "<b>👋 Welcome {first_name}!</b>\n\n"
+    "{referral_notice}"
+    "<b>🚀 {bot_name}</b>\n"
+    "<b>📍 Version:</b> {bot_version}\n\n"
+    "<b>💰 YOUR CREDITS:</b>\n"
+    "🆓 <b>Daily:</b> <code>{daily_credits}</code>/{max_free_credits} (resets at {reset_hour}:00)\n"
+    "💎 <b>Extra:</b> <code>{extra_credits}</code> (permanent)\n"
+    "🎯 <b>Total:</b> <code>{total_credits}</code>\n\n"
+    "<b>📁 Files in DB:</b> <code>{total_files}</code>\n\n"
+    "<i>Use buttons to start</i>"
+)
+
+WELCOME_REFERRAL_NOTICE = (
+    "<b>🎉 REFERRAL BONUS!</b>\n"
+    "You joined using a referral link!\n\n"
+)
+
+SEARCH_DOMAIN_TEMPLATE = (
+    "<b>🔍 SEARCH DOMAIN</b>\n\n"
+    "<b>Domain:</b> <code>{domain}</code>\n"
+    "<b>Daily credits:</b> <code>{daily_credits}</code>/{max_free_credits}\n"
+    "<b>Total credits:</b> <code>{total_credits}</code>\n\n"
+    "<b>Select format:</b>"
+)
+
+REFERRAL_TEMPLATE = (
+    "<b>🤝 REFERRAL SYSTEM</b>\n\n"
+    "<b>🎁 HOW IT WORKS:</b>\n"
+    "• Share your referral link with friends\n"
+    "• When they join using your link:\n"
+    "  → You get: <b>+{referral_bonus} credits</b>\n"
+    "  → They get: <b>{max_free_credits} daily credits</b>\n\n"
+    
+    "<b>📊 YOUR STATS:</b>\n"
+    "👥 <b>Referrals made:</b> <code>{referrals_count}</code>\n"
+    "💰 <b>Total earned:</b> <code>{total_earned}</code> credits\n"
+    "🔑 <b>Your code:</b> <code>{referral_code}</code>\n\n"
+    
+    "<b>🔗 YOUR REFERRAL LINK:</b>\n"
+    "<code>{referral_link}</code>\n\n"
+    
+    "<b>📝 HOW TO SHARE:</b>\n"
+    "1. Copy the link above\n"
+    "2. Share it with friends\n"
+    "3. Earn credits when they join!\n\n"
+    
+    "<i>Credits are added automatically when they use /start</i>"
+)
+
+MYCREDITS_TEMPLATE = (
+    "<b>💰 YOUR CREDITS</b>\n\n"
+    "👤 <b>User:</b> @{username}\n"
+    "🆔 <b>ID:</b> <code>{user_id}</code>\n\n"
+    "<b>💳 AVAILABLE CREDITS:</b>\n"
+    "🆓 <b>Daily:</b> <code>{daily_credits}</code>/{max_free_credits}\n"
+    "💎 <b>Extra:</b> <code>{extra_credits}</code>\n"
+    "🎯 <b>Total:</b> <code>{total_credits}</code>\n\n"
+    "<b>⏰ NEXT RESET:</b>\n"
+    "🔄 <b>Time:</b> {reset_hour}:00\n"
+    "⏳ <b>Time left:</b> {hours_to_reset}h {minutes_to_reset}m\n\n"
+    "<b>📊 STATISTICS:</b>\n"
+    "🔍 <b>Total searches:</b> <code>{total_searches}</code>\n\n"
+    "<b>💡 INFORMATION:</b>\n"
+    "• Daily credits reset at {reset_hour}:00\n"
+    "• Extra credits are permanent\n"
+    "• Contact {bot_owner} for extra credits"
+)
+
+MENU_CREDITS_TEMPLATE = (
+    "<b>💰 YOUR CREDITS</b>\n\n"
+    "🆓 <b>Daily:</b> <code>{daily_credits}</code>/{max_free_credits}\n"
+    "🎯 <b>Total:</b> <code>{total_credits}</code>\n\n"
+    "<i>Use /mycredits for details</i>"
+)
+
+STATS_TEMPLATE = (
+    "<b>📊 BOT STATISTICS</b>\n\n"
+    "👥 <b>Users:</b> <code>{total_users}</code>\n"
+    "🔍 <b>Total searches:</b> <code>{total_searches}</code>\n"
+    "💰 <b>Total credits:</b> <code>{total_credits}</code>\n"
+    "👥 <b>Total referrals:</b> <code>{total_referrals}</code>\n"
+    "📢 <b>Total broadcasts:</b> <code>{total_broadcasts}</code>\n"
+    "📁 <b>Files in DB:</b> <code>{total_files}</code>\n"
+    "🔄 <b>Daily reset:</b> {reset_hour}:00\n\n"
+    "<b>📂 RECENT FILES:</b>\n"
+    "{recent_files}\n\n"
+    "🤖 <b>Version:</b> {bot_version}\n"
+    "👑 <b>Admin:</b> @{admin_username}"
+)
+
+# Huecos fijos de las plantillas; los dinámicos se añaden delante con ChainMap
+TEMPLATE_CONSTANTS = {
+    "referral_bonus": REFERRAL_BONUS,
+    "max_free_credits": MAX_FREE_CREDITS,
+    "reset_hour": RESET_HOUR,
+    "bot_owner": BOT_OWNER,
+    "bot_version": BOT_VERSION,
+    "bot_name": BOT_NAME,
+}
+
+# ============================================================================
+# KEYBOARDS
+# ============================================================================
+
+# Los teclados fijos se crean una vez; los objetos de telegram son inmutables
+_MAIN_MENU_ROWS = (
+    (InlineKeyboardButton("🔍 Search Domain", callback_data="menu_search"),),
+    (InlineKeyboardButton("📧 Search Email", callback_data="menu_email"),),
+    (InlineKeyboardButton("💰 My Credits", callback_data="menu_credits"),),
+    (InlineKeyboardButton("👥 Referral System", callback_data="menu_referral"),),
+    (InlineKeyboardButton("📋 /help", callback_data="menu_help"),),
+)
+
+MAIN_KEYBOARD = InlineKeyboardMarkup(_MAIN_MENU_ROWS)
+
+MAIN_KEYBOARD_ADMIN = InlineKeyboardMarkup(
+    _MAIN_MENU_ROWS + ((InlineKeyboardButton("👑 Admin", callback_data="menu_admin"),),)
+)
+
+FORMAT_KEYBOARD = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔐 email:pass (extracted)", callback_data="format_emailpass"),
+        InlineKeyboardButton("🔗 url:email:pass (full)", callback_data="format_urlemailpass")
+    ],
+    [InlineKeyboardButton("❌ Cancel", callback_data="format_cancel")]
+])
+
+ADMIN_PANEL_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📊 Statistics", callback_data="admin_stats")],
+    [InlineKeyboardButton("📋 List Users", callback_data="admin_users")],
+    [InlineKeyboardButton("📢 Broadcast", callback_data="admin_broadcast")],
+    [InlineKeyboardButton("📤 Upload File", callback_data="admin_upload")],
+])
+
+REFERRAL_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Copy Link", callback_data="copy_referral")],
+    [InlineKeyboardButton("💰 My Credits", callback_data="menu_credits")]
+])
+
+PRICE_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("👥 Referral System", callback_data="menu_referral")],
+    [InlineKeyboardButton("💰 My Credits", callback_data="menu_credits")]
+])
 
 # ============================================================================
 # MAIN BOT - CORREGIDO: DNI CON DOMINIO Y FILTROS EXACTOS
@@ -655,16 +1815,109 @@ class ULPBot:
     def __init__(self, search_engine: SearchEngine, credit_system: CreditSystem):
         self.search_engine = search_engine
         self.credit_system = credit_system
-        self.pending_searches = {}
+        self.pending_searches = ExpiringDict(PENDING_SEARCH_TTL, PENDING_SEARCH_MAX)
+        # (chat_id, message_id) -> (texto, teclado) del último edit de menú
+        self._menu_messages = {}
+    
+    async def post_init(self, application: Application):
+        await start_health_server(application)
+        application.bot_data['reset_task'] = asyncio.create_task(self.daily_reset_loop())
+    
+    async def post_shutdown(self, application: Application):
+        task = application.bot_data.pop('reset_task', None)
+        if task is not None:
+            task.cancel()
+        await stop_health_server(application)
+    
+    async def daily_reset_loop(self):
+        """Reset de créditos al arrancar y después cada día a RESET_HOUR (UTC)"""
+        while True:
+            try:
+                count = await asyncio.to_thread(self.credit_system.reset_daily_credits)
+                if count:
+                    logger.info(f"🔄 Daily credits reset for {count} users")
+            except Exception as e:
+                logger.error(f"Error in daily reset: {e}")
+            
+            await asyncio.sleep(seconds_until_reset(datetime.utcnow()))
+    
+    async def edit_menu(self, query, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """edit_message_text para menús: evita ediciones que no cambian nada.
+        
+        Si solo cambia el teclado se usa edit_message_reply_markup.
+        """
+        message = query.message
+        key = (message.chat_id, message.message_id) if message else None
+        last = self._menu_messages.get(key)
+        
+        try:
+            if last and last[0] == text:
+                if last[1] != reply_markup:
+                    await query.edit_message_reply_markup(reply_markup=reply_markup)
+            else:
+                await query.edit_message_text(text, parse_mode='HTML', reply_markup=reply_markup)
+        except BadRequest as e:
+            if 'not modified' not in str(e):
+                raise
+        
+        if key:
+            self._menu_messages.pop(key, None)
+            self._menu_messages[key] = (text, reply_markup)
+            if len(self._menu_messages) > MENU_CACHE_SIZE:
+                del self._menu_messages[next(iter(self._menu_messages))]
     
     def escape_html(self, text: str) -> str:
         if not text:
             return ""
-        text = str(text)
-        text = text.replace('&', '&amp;')
-        text = text.replace('<', '&lt;')
-        text = text.replace('>', '&gt;')
-        return text
+        return str(text).translate(_HTML_ESCAPE)
+    
+    @staticmethod
+    def results_buffer(results: List[str], chunk_size: int = 5000) -> io.BytesIO:
+        """Archivo .txt en memoria con una línea por resultado.
+        
+        Se codifica por bloques: nunca existe a la vez un str con todos los
+        resultados y su copia en bytes.
+        """
+        buffer = io.BytesIO()
+        for i in range(0, len(results), chunk_size):
+            if i:
+                buffer.write(b"\n")
+            buffer.write("\n".join(results[i:i + chunk_size]).encode('utf-8'))
+        buffer.seek(0)
+        return buffer
+    
+    @staticmethod
+    def grouped_results_zip(results: Dict[str, List[str]], chunk_size: int = 5000) -> io.BytesIO:
+        """.zip en memoria con un .txt por texto buscado (los vacíos se omiten)"""
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for i, (needle, lines) in enumerate(results.items(), 1):
+                if not lines:
+                    continue
+                safe_name = _FILENAME_UNSAFE.sub('_', needle)[:50]
+                with zip_file.open(f"{i:02d}_{safe_name}_{len(lines)}.txt", 'w') as part:
+                    for j in range(0, len(lines), chunk_size):
+                        if j:
+                            part.write(b"\n")
+                        part.write("\n".join(lines[j:j + chunk_size]).encode('utf-8'))
+        buffer.seek(0)
+        return buffer
+    
+    @staticmethod
+    def results_zip(results: List[str], part_filename, chunk_size: int = 5000) -> Tuple[io.BytesIO, int]:
+        """.zip en memoria con los resultados en partes de chunk_size líneas.
+        
+        part_filename(parte, total) da el nombre de cada .txt; devuelve
+        (buffer, número de partes).
+        """
+        buffer = io.BytesIO()
+        total_parts = (len(results) + chunk_size - 1) // chunk_size
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for i in range(0, len(results), chunk_size):
+                content = "\n".join(results[i:i + chunk_size])
+                zip_file.writestr(part_filename(i // chunk_size + 1, total_parts), content)
+        buffer.seek(0)
+        return buffer, total_parts
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
@@ -684,40 +1937,20 @@ class ULPBot:
             referred_by=referred_by
         )
         
-        total_credits = self.credit_system.get_user_credits(user.id)
-        daily_credits = self.credit_system.get_daily_credits_left(user.id)
+        total_credits, daily_credits = self.credit_system.get_credit_snapshot(user.id)
         extra_credits = total_credits - daily_credits
         stats = self.search_engine.get_stats()
         
-        keyboard = [
-            [InlineKeyboardButton("🔍 Search Domain", callback_data="menu_search")],
-            [InlineKeyboardButton("📧 Search Email", callback_data="menu_email")],
-            [InlineKeyboardButton("💰 My Credits", callback_data="menu_credits")],
-            [InlineKeyboardButton("👥 Referral System", callback_data="menu_referral")],
-            [InlineKeyboardButton("📋 /help", callback_data="menu_help")],
-        ]
-        
-        if user.id in ADMIN_IDS:
-            keyboard.append([InlineKeyboardButton("👑 Admin", callback_data="menu_admin")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = MAIN_KEYBOARD_ADMIN if user.id in ADMIN_IDS else MAIN_KEYBOARD
         
-        welcome_msg = f"<b>👋 Welcome {self.escape_html(user.first_name)}!</b>\n\n"
-        
-        if referred_by:
-            welcome_msg += f"<b>🎉 REFERRAL BONUS!</b>\n"
-            welcome_msg += f"You joined using a referral link!\n\n"
-        
-        welcome_msg += (
-            f"<b>🚀 {BOT_NAME}</b>\n"
-            f"<b>📍 Version:</b> {BOT_VERSION}\n\n"
-            f"<b>💰 YOUR CREDITS:</b>\n"
-            f"🆓 <b>Daily:</b> <code>{daily_credits}</code>/{MAX_FREE_CREDITS} (resets at {RESET_HOUR}:00)\n"
-            f"💎 <b>Extra:</b> <code>{extra_credits}</code> (permanent)\n"
-            f"🎯 <b>Total:</b> <code>{total_credits}</code>\n\n"
-            f"<b>📁 Files in DB:</b> <code>{stats['total_files']}</code>\n\n"
-            f"<i>Use buttons to start</i>"
-        )
+        welcome_msg = WELCOME_TEMPLATE.format_map(ChainMap({
+            "first_name": self.escape_html(user.first_name),
+            "referral_notice": WELCOME_REFERRAL_NOTICE if referred_by else "",
+            "daily_credits": daily_credits,
+            "extra_credits": extra_credits,
+            "total_credits": total_credits,
+            "total_files": stats['total_files'],
+        }, TEMPLATE_CONSTANTS))
         
         await update.message.reply_text(welcome_msg, parse_mode='HTML', reply_markup=reply_markup)
     
@@ -746,27 +1979,16 @@ class ULPBot:
         query = context.args[0].lower()
         self.pending_searches[user_id] = {"query": query}
         
-        keyboard = [
-            [
-                InlineKeyboardButton("🔐 email:pass (extracted)", callback_data="format_emailpass"),
-                InlineKeyboardButton("🔗 url:email:pass (full)", callback_data="format_urlemailpass")
-            ],
-            [InlineKeyboardButton("❌ Cancel", callback_data="format_cancel")]
-        ]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        daily_credits = self.credit_system.get_daily_credits_left(user_id)
-        total_credits = self.credit_system.get_user_credits(user_id)
+        total_credits, daily_credits = self.credit_system.get_credit_snapshot(user_id)
         
         await update.message.reply_text(
-            f"<b>🔍 SEARCH DOMAIN</b>\n\n"
-            f"<b>Domain:</b> <code>{self.escape_html(query)}</code>\n"
-            f"<b>Daily credits:</b> <code>{daily_credits}</code>/{MAX_FREE_CREDITS}\n"
-            f"<b>Total credits:</b> <code>{total_credits}</code>\n\n"
-            f"<b>Select format:</b>",
+            SEARCH_DOMAIN_TEMPLATE.format_map(ChainMap({
+                "domain": self.escape_html(query),
+                "daily_credits": daily_credits,
+                "total_credits": total_credits,
+            }, TEMPLATE_CONSTANTS)),
             parse_mode='HTML',
-            reply_markup=reply_markup
+            reply_markup=FORMAT_KEYBOARD
         )
         
         return CHOOSING_FORMAT
@@ -777,23 +1999,23 @@ class ULPBot:
         
         user_id = query.from_user.id
         
-        if user_id not in self.pending_searches:
+        # Se saca al empezar: un segundo clic no lanza otra búsqueda
+        search_data = self.pending_searches.pop(user_id)
+        if search_data is None:
             await query.edit_message_text("❌ Search expired.")
             return ConversationHandler.END
         
         if query.data == "format_cancel":
             await query.edit_message_text("✅ Canceled.")
-            del self.pending_searches[user_id]
             return ConversationHandler.END
         
-        search_data = self.pending_searches[user_id]
         domain = search_data["query"]
         selected_format = query.data
         
         await query.edit_message_text(f"🔄 <b>Searching {self.escape_html(domain)}...</b>", parse_mode='HTML')
         
         # Buscar TODOS los resultados SIN LÍMITE
-        total_found, all_results = self.search_engine.search_domain(domain, max_results=None)
+        total_found, all_results = await asyncio.to_thread(self.search_engine.search_domain, domain)
         
         if total_found == 0:
             await query.edit_message_text(
@@ -803,42 +2025,31 @@ class ULPBot:
                 f"💰 <b>Credit NOT consumed</b>",
                 parse_mode='HTML'
             )
-            del self.pending_searches[user_id]
             return ConversationHandler.END
         
-        # FILTRAR según el formato seleccionado
+        # FILTRAR según el formato seleccionado. Las líneas ya llegan limpias
+        # del buscador y el formato se decide una vez, no en cada línea
         filtered_results = []
         
-        for line in all_results:
-            line = line.strip()
-            if not line:
-                continue
-                
-            if selected_format == "format_emailpass":
-                # 🔥 EXTRACTO SOLO email:password de CUALQUIER formato
+        if selected_format == "format_emailpass":
+            # 🔥 EXTRACTO SOLO email:password de CUALQUIER formato
+            for line in all_results:
                 parts = line.split(':')
                 
-                # Buscar el email (que contiene @) y la contraseña
-                email = None
-                password = None
-                
+                # Buscar el email (que contiene @); la contraseña suele ser el siguiente campo
                 for i, part in enumerate(parts):
-                    if '@' in part and '.' in part:  # Es un email
-                        email = part
-                        # La contraseña suele ser el siguiente campo
-                        if i + 1 < len(parts):
-                            password = parts[i + 1]
+                    if '@' in part and '.' in part:
+                        password = parts[i + 1] if i + 1 < len(parts) else None
+                        if password:
+                            filtered_results.append(f"{part}:{password}")
                         break
-                
-                # Si encontramos email y password, creamos línea email:pass
-                if email and password:
-                    filtered_results.append(f"{email}:{password}")
-                    
-            elif selected_format == "format_urlemailpass":
-                # 🔥 LÍNEA COMPLETA ORIGINAL (url:email:pass o cualquier formato)
-                # Solo verificamos que tenga al menos 2 ':' y que contenga @
-                if line.count(':') >= 2 and '@' in line:
-                    filtered_results.append(line)
+        
+        elif selected_format == "format_urlemailpass":
+            # 🔥 LÍNEA COMPLETA ORIGINAL: al menos 2 ':' y que contenga @
+            filtered_results = [
+                line for line in all_results
+                if line.count(':') >= 2 and '@' in line
+            ]
         
         # Si no hay resultados después del filtro
         if not filtered_results:
@@ -851,17 +2062,14 @@ class ULPBot:
                 f"💰 <b>Credit NOT consumed</b>",
                 parse_mode='HTML'
             )
-            del self.pending_searches[user_id]
             return ConversationHandler.END
         
         # CONSUMIR CRÉDITO SOLO AHORA
         if not self.credit_system.use_credits(user_id, "domain", domain, len(filtered_results)):
             await query.edit_message_text("<b>❌ Error using credits</b>", parse_mode='HTML')
-            del self.pending_searches[user_id]
             return ConversationHandler.END
         
-        total_credits = self.credit_system.get_user_credits(user_id)
-        daily_credits = self.credit_system.get_daily_credits_left(user_id)
+        total_credits, daily_credits = self.credit_system.get_credit_snapshot(user_id)
         
         # SIEMPRE ARCHIVO
         if len(filtered_results) < 5000:
@@ -885,16 +2093,12 @@ class ULPBot:
                 selected_format
             )
         
-        del self.pending_searches[user_id]
         return ConversationHandler.END
     
     async def send_results_as_txt(self, query_callback, results: list, domain: str, total_found: int, 
                                   daily_credits: int, total_credits: int, selected_format: str):
         """Siempre envía como archivo .txt"""
-        txt_buffer = io.BytesIO()
-        content = "\n".join(results)
-        txt_buffer.write(content.encode('utf-8'))
-        txt_buffer.seek(0)
+        txt_buffer = await asyncio.to_thread(self.results_buffer, results)
         
         if selected_format == "format_emailpass":
             format_name = "email_pass_extracted"
@@ -932,8 +2136,6 @@ class ULPBot:
     async def send_results_as_zip(self, query_callback, results: list, domain: str, total_found: int,
                                   daily_credits: int, total_credits: int, selected_format: str):
         """Divide en partes de 5000 líneas y comprime"""
-        zip_buffer = io.BytesIO()
-        
         if selected_format == "format_emailpass":
             format_name = "email_pass_extracted"
             format_display = "email:password (extracted)"
@@ -941,18 +2143,11 @@ class ULPBot:
             format_name = "url_email_pass_full"
             format_display = "url:email:password (full line)"
         
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            chunk_size = 5000
-            total_parts = (len(results) + chunk_size - 1) // chunk_size
-            
-            for i in range(0, len(results), chunk_size):
-                chunk = results[i:i + chunk_size]
-                content = "\n".join(chunk)
-                part_num = i // chunk_size + 1
-                filename = f"ulp_{domain}_{format_name}_part{part_num}_of_{total_parts}.txt"
-                zip_file.writestr(filename, content)
-        
-        zip_buffer.seek(0)
+        # Comprimir puede tardar segundos: fuera del bucle de eventos
+        zip_buffer, total_parts = await asyncio.to_thread(
+            self.results_zip, results,
+            lambda part, total: f"ulp_{domain}_{format_name}_part{part}_of_{total}.txt"
+        )
         
         await query_callback.message.reply_document(
             document=zip_buffer,
@@ -1000,9 +2195,18 @@ class ULPBot:
             return
         
         email = context.args[0].lower()
+        
+        if not EMAIL_QUERY_PATTERN.fullmatch(email):
+            await update.message.reply_text(
+                "<b>❌ Invalid email</b>\n\n"
+                "<b>Usage:</b> <code>/email user@gmail.com</code>",
+                parse_mode='HTML'
+            )
+            return
+        
         msg = await update.message.reply_text(f"📧 <b>Searching {self.escape_html(email)}...</b>", parse_mode='HTML')
         
-        total_found, results = self.search_engine.search_email(email, max_results=None)
+        total_found, results = await asyncio.to_thread(self.search_engine.search_email, email)
         
         if total_found == 0:
             await msg.edit_text(
@@ -1016,13 +2220,10 @@ class ULPBot:
             await msg.edit_text("<b>❌ Error using credits</b>", parse_mode='HTML')
             return
         
-        total_credits = self.credit_system.get_user_credits(user_id)
-        daily_credits = self.credit_system.get_daily_credits_left(user_id)
+        total_credits, daily_credits = self.credit_system.get_credit_snapshot(user_id)
         
         # Siempre archivo
-        txt_buffer = io.BytesIO()
-        txt_buffer.write("\n".join(results).encode('utf-8'))
-        txt_buffer.seek(0)
+        txt_buffer = await asyncio.to_thread(self.results_buffer, results)
         
         await msg.reply_document(
             document=txt_buffer,
@@ -1060,7 +2261,7 @@ class ULPBot:
         login = context.args[0].lower()
         msg = await update.message.reply_text(f"👤 <b>Searching {self.escape_html(login)}...</b>", parse_mode='HTML')
         
-        total_found, results = self.search_engine.search_login(login, max_results=None)
+        total_found, results = await asyncio.to_thread(self.search_engine.search_login, login)
         
         if total_found == 0:
             await msg.edit_text(
@@ -1074,12 +2275,9 @@ class ULPBot:
             await msg.edit_text("<b>❌ Error using credits</b>", parse_mode='HTML')
             return
         
-        total_credits = self.credit_system.get_user_credits(user_id)
-        daily_credits = self.credit_system.get_daily_credits_left(user_id)
+        total_credits, daily_credits = self.credit_system.get_credit_snapshot(user_id)
         
-        txt_buffer = io.BytesIO()
-        txt_buffer.write("\n".join(results).encode('utf-8'))
-        txt_buffer.seek(0)
+        txt_buffer = await asyncio.to_thread(self.results_buffer, results)
         
         await msg.reply_document(
             document=txt_buffer,
@@ -1117,7 +2315,7 @@ class ULPBot:
         password = context.args[0].lower()
         msg = await update.message.reply_text(f"🔑 <b>Searching password...</b>", parse_mode='HTML')
         
-        total_found, results = self.search_engine.search_password(password, max_results=None)
+        total_found, results = await asyncio.to_thread(self.search_engine.search_password, password)
         
         if total_found == 0:
             await msg.edit_text(
@@ -1131,12 +2329,9 @@ class ULPBot:
             await msg.edit_text("<b>❌ Error using credits</b>", parse_mode='HTML')
             return
         
-        total_credits = self.credit_system.get_user_credits(user_id)
-        daily_credits = self.credit_system.get_daily_credits_left(user_id)
+        total_credits, daily_credits = self.credit_system.get_credit_snapshot(user_id)
         
-        txt_buffer = io.BytesIO()
-        txt_buffer.write("\n".join(results).encode('utf-8'))
-        txt_buffer.seek(0)
+        txt_buffer = await asyncio.to_thread(self.results_buffer, results)
         
         await msg.reply_document(
             document=txt_buffer,
@@ -1178,21 +2373,33 @@ class ULPBot:
             return
         
         query = context.args[0].upper()
-        msg = await update.message.reply_text(f"🆔 <b>Searching DNI combos: {self.escape_html(query)}...</b>", parse_mode='HTML')
-        
+
         # Detectar si es un DNI (8 números + letra) o un dominio
-        dni_pattern = r'^[0-9]{8}[A-Z]$'
-        
-        if re.match(dni_pattern, query):
+        is_dni = DNI_QUERY_PATTERN.fullmatch(query) is not None
+
+        # Letra de control incorrecta: no hace falta recorrer los archivos
+        if is_dni and not is_valid_dni(query):
+            await update.message.reply_text(
+                f"<b>❌ INVALID DNI</b>\n\n"
+                f"<b>DNI:</b> <code>{self.escape_html(query)}</code>\n"
+                f"The control letter does not match the number.\n\n"
+                f"💰 <b>Credit NOT consumed</b>",
+                parse_mode='HTML'
+            )
+            return
+
+        msg = await update.message.reply_text(f"🆔 <b>Searching DNI combos: {self.escape_html(query)}...</b>", parse_mode='HTML')
+
+        if is_dni:
             # Búsqueda por número de DNI
-            total_found, results = self.search_engine.search_dni(query, max_results=None)
+            total_found, results = await asyncio.to_thread(self.search_engine.search_dni, query)
             search_type = "dni_number"
-            search_display = f"DNI: {query}"
+            search_display = f"DNI: {self.escape_html(query)}"
         else:
             # Búsqueda por dominio
-            total_found, results = self.search_engine.search_dni_by_domain(query.lower(), max_results=None)
+            total_found, results = await asyncio.to_thread(self.search_engine.search_dni_by_domain, query.lower())
             search_type = "dni_domain"
-            search_display = f"Domain: {query.lower()}"
+            search_display = f"Domain: {self.escape_html(query.lower())}"
         
         if total_found == 0:
             await msg.edit_text(
@@ -1207,15 +2414,11 @@ class ULPBot:
             await msg.edit_text("<b>❌ Error using credits</b>", parse_mode='HTML')
             return
         
-        total_credits = self.credit_system.get_user_credits(user_id)
-        daily_credits = self.credit_system.get_daily_credits_left(user_id)
+        total_credits, daily_credits = self.credit_system.get_credit_snapshot(user_id)
         
         # Siempre archivo
         if total_found < 5000:
-            txt_buffer = io.BytesIO()
-            content = "\n".join(results)
-            txt_buffer.write(content.encode('utf-8'))
-            txt_buffer.seek(0)
+            txt_buffer = await asyncio.to_thread(self.results_buffer, results)
             
             filename = f"ulp_dni_{query}_{total_found}.txt" if search_type == "dni_number" else f"ulp_dni_domain_{query}_{total_found}.txt"
             
@@ -1233,24 +2436,11 @@ class ULPBot:
                 parse_mode='HTML'
             )
         else:
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                chunk_size = 5000
-                total_parts = (len(results) + chunk_size - 1) // chunk_size
-                
-                for i in range(0, len(results), chunk_size):
-                    chunk = results[i:i + chunk_size]
-                    content = "\n".join(chunk)
-                    part_num = i // chunk_size + 1
-                    
-                    if search_type == "dni_number":
-                        filename = f"ulp_dni_{query}_part{part_num}_of_{total_parts}.txt"
-                    else:
-                        filename = f"ulp_dni_domain_{query}_part{part_num}_of_{total_parts}.txt"
-                    
-                    zip_file.writestr(filename, content)
-            
-            zip_buffer.seek(0)
+            prefix = "ulp_dni" if search_type == "dni_number" else "ulp_dni_domain"
+            zip_buffer, total_parts = await asyncio.to_thread(
+                self.results_zip, results,
+                lambda part, total: f"{prefix}_{query}_part{part}_of_{total}.txt"
+            )
             
             zip_filename = f"ulp_dni_{query}_{total_found}.zip" if search_type == "dni_number" else f"ulp_dni_domain_{query}_{total_found}.zip"
             
@@ -1273,40 +2463,24 @@ class ULPBot:
     
     async def mycredits_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        total_credits = self.credit_system.get_user_credits(user_id)
-        daily_credits = self.credit_system.get_daily_credits_left(user_id)
+        total_credits, daily_credits = self.credit_system.get_credit_snapshot(user_id)
         extra_credits = total_credits - daily_credits
         user_info = self.credit_system.get_user_info(user_id)
         
-        now = datetime.now()
-        reset_time = time(hour=RESET_HOUR, minute=0, second=0)
-        
-        if now.time() < reset_time:
-            next_reset = datetime.combine(now.date(), reset_time)
-        else:
-            next_reset = datetime.combine(now.date() + timedelta(days=1), reset_time)
-        
-        hours_to_reset = (next_reset - now).seconds // 3600
-        minutes_to_reset = ((next_reset - now).seconds % 3600) // 60
-        
-        response = (
-            f"<b>💰 YOUR CREDITS</b>\n\n"
-            f"👤 <b>User:</b> @{update.effective_user.username or update.effective_user.first_name}\n"
-            f"🆔 <b>ID:</b> <code>{user_id}</code>\n\n"
-            f"<b>💳 AVAILABLE CREDITS:</b>\n"
-            f"🆓 <b>Daily:</b> <code>{daily_credits}</code>/{MAX_FREE_CREDITS}\n"
-            f"💎 <b>Extra:</b> <code>{extra_credits}</code>\n"
-            f"🎯 <b>Total:</b> <code>{total_credits}</code>\n\n"
-            f"<b>⏰ NEXT RESET:</b>\n"
-            f"🔄 <b>Time:</b> {RESET_HOUR}:00\n"
-            f"⏳ <b>Time left:</b> {hours_to_reset}h {minutes_to_reset}m\n\n"
-            f"<b>📊 STATISTICS:</b>\n"
-            f"🔍 <b>Total searches:</b> <code>{user_info.get('total_searches', 0) if user_info else 0}</code>\n\n"
-            f"<b>💡 INFORMATION:</b>\n"
-            f"• Daily credits reset at {RESET_HOUR}:00\n"
-            f"• Extra credits are permanent\n"
-            f"• Contact {BOT_OWNER} for extra credits"
-        )
+        seconds_to_reset = seconds_until_reset(datetime.utcnow())
+        hours_to_reset = seconds_to_reset // 3600
+        minutes_to_reset = seconds_to_reset % 3600 // 60
+        
+        response = MYCREDITS_TEMPLATE.format_map(ChainMap({
+            "username": self.escape_html(update.effective_user.username or update.effective_user.first_name),
+            "user_id": user_id,
+            "daily_credits": daily_credits,
+            "extra_credits": extra_credits,
+            "total_credits": total_credits,
+            "hours_to_reset": hours_to_reset,
+            "minutes_to_reset": minutes_to_reset,
+            "total_searches": (user_info.get('total_searches') or 0) if user_info else 0,
+        }, TEMPLATE_CONSTANTS))
         
         await update.message.reply_text(response, parse_mode='HTML')
     
@@ -1319,16 +2493,18 @@ class ULPBot:
             await update.message.reply_text("❌ User not found")
             return
         
-        total_credits = self.credit_system.get_user_credits(user_id)
-        daily_credits = self.credit_system.get_daily_credits_left(user_id)
+        total_credits, daily_credits = self.credit_system.get_credit_snapshot(user_id)
         extra_credits = total_credits - daily_credits
         
-        referrals_count = referral_stats.get('referrals_count', 0) if referral_stats else 0
-        total_referred = referral_stats.get('total_referred', 0) if referral_stats else 0
+        referrals_count, total_referred = (
+            (referral_stats.get('referrals_count', 0), referral_stats.get('total_referred', 0))
+            if referral_stats else (0, 0)
+        )
+        total_searches = user_info.get('total_searches') or 0
         
         response = (
             f"<b>📊 YOUR STATISTICS</b>\n\n"
-            f"👤 <b>User:</b> @{update.effective_user.username or update.effective_user.first_name}\n"
+            f"👤 <b>User:</b> @{self.escape_html(update.effective_user.username or update.effective_user.first_name)}\n"
             f"🆔 <b>ID:</b> <code>{user_id}</code>\n"
             f"📅 <b>Join date:</b> {user_info.get('join_date', 'N/A')}\n\n"
             
@@ -1338,7 +2514,7 @@ class ULPBot:
             f"🎯 <b>Total:</b> <code>{total_credits}</code>\n\n"
             
             f"<b>🔍 SEARCHES:</b>\n"
-            f"📈 <b>Total searches:</b> <code>{user_info.get('total_searches', 0)}</code>\n\n"
+            f"📈 <b>Total searches:</b> <code>{total_searches}</code>\n\n"
             
             f"<b>👥 REFERRALS:</b>\n"
             f"🤝 <b>Referrals made:</b> <code>{referrals_count}</code>\n"
@@ -1360,74 +2536,18 @@ class ULPBot:
             return
         
         referrals_count = referral_stats.get('referrals_count', 0)
-        referral_code = referral_stats.get('referral_code', 'N/A')
-        
-        response = (
-            f"<b>🤝 REFERRAL SYSTEM</b>\n\n"
-            f"<b>🎁 HOW IT WORKS:</b>\n"
-            f"• Share your referral link with friends\n"
-            f"• When they join using your link:\n"
-            f"  → You get: <b>+{REFERRAL_BONUS} credits</b>\n"
-            f"  → They get: <b>{MAX_FREE_CREDITS} daily credits</b>\n\n"
-            
-            f"<b>📊 YOUR STATS:</b>\n"
-            f"👥 <b>Referrals made:</b> <code>{referrals_count}</code>\n"
-            f"💰 <b>Total earned:</b> <code>{referrals_count * REFERRAL_BONUS}</code> credits\n"
-            f"🔑 <b>Your code:</b> <code>{referral_code}</code>\n\n"
-            
-            f"<b>🔗 YOUR REFERRAL LINK:</b>\n"
-            f"<code>{referral_link}</code>\n\n"
-            
-            f"<b>📝 HOW TO SHARE:</b>\n"
-            f"1. Copy the link above\n"
-            f"2. Share it with friends\n"
-            f"3. Earn credits when they join!\n\n"
-            
-            f"<i>Credits are added automatically when they use /start</i>"
-        )
         
-        keyboard = [
-            [InlineKeyboardButton("📋 Copy Link", callback_data="copy_referral")],
-            [InlineKeyboardButton("💰 My Credits", callback_data="menu_credits")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        response = REFERRAL_TEMPLATE.format_map(ChainMap({
+            "referrals_count": referrals_count,
+            "total_earned": referrals_count * REFERRAL_BONUS,
+            "referral_code": referral_stats.get('referral_code', 'N/A'),
+            "referral_link": referral_link,
+        }, TEMPLATE_CONSTANTS))
         
-        await update.message.reply_text(response, parse_mode='HTML', reply_markup=reply_markup)
+        await update.message.reply_text(response, parse_mode='HTML', reply_markup=REFERRAL_KEYBOARD)
     
     async def price_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        response = (
-            f"<b>💰 PRICE INFORMATION</b>\n\n"
-            f"<b>🎯 FREE SYSTEM:</b>\n"
-            f"🆓 <b>{MAX_FREE_CREDITS} free daily credits</b>\n"
-            f"🔄 <b>Resets at:</b> {RESET_HOUR}:00\n"
-            f"👥 <b>Referral bonus:</b> +{REFERRAL_BONUS} credits per friend\n\n"
-            
-            f"<b>💎 EXTRA CREDITS:</b>\n"
-            f"• Contact {BOT_OWNER} for extra credits\n"
-            f"• Extra credits are permanent\n"
-            f"• They don't reset daily\n\n"
-            
-            f"<b>📊 CREDIT VALUES:</b>\n"
-            f"🔍 <b>1 credit</b> = <b>1 search</b>\n"
-            f"📁 <b>Results delivery:</b>\n"
-            f"  • <5000 results → .txt file\n"
-            f"  • ≥5000 results → .zip file (split into parts)\n\n"
-            
-            f"<b>💡 TIPS:</b>\n"
-            f"• Use specific terms for better results\n"
-            f"• Invite friends to earn free credits\n"
-            f"• Contact {BOT_OWNER} for more credits\n\n"
-            
-            f"<i>Bot developed by {BOT_OWNER}</i>"
-        )
-        
-        keyboard = [
-            [InlineKeyboardButton("👥 Referral System", callback_data="menu_referral")],
-            [InlineKeyboardButton("💰 My Credits", callback_data="menu_credits")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(response, parse_mode='HTML', reply_markup=reply_markup)
+        await update.message.reply_text(PRICE_MESSAGE, parse_mode='HTML', reply_markup=PRICE_KEYBOARD)
     
     async def info_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         response = (
@@ -1464,66 +2584,14 @@ class ULPBot:
         await update.message.reply_text(response, parse_mode='HTML')
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        help_text = (
-            f"<b>📚 {BOT_NAME} - COMPLETE HELP</b>\n\n"
-            
-            f"<b>🎯 FREE SYSTEM:</b>\n"
-            f"• Max {MAX_FREE_CREDITS} free credits\n"
-            f"• 1 credit = 1 search\n"
-            f"• Invite friends: +{REFERRAL_BONUS} credit per referral\n\n"
-            
-            f"<b>🔍 SEARCH COMMANDS:</b>\n"
-            f"<code>/search domain.com</code> - Search by domain\n"
-            f"  • email:pass (extracted) - SOLO email:password\n"
-            f"  • url:email:pass (full) - Línea completa\n"
-            f"<code>/email user@gmail.com</code> - Search by email\n"
-            f"<code>/login username</code> - Search by login\n"
-            f"<code>/pass password123</code> - Search by password\n"
-            f"<code>/dni 12345678A</code> - Search DNI:password by DNI number\n"
-            f"<code>/dni dominio.com</code> - Search DNI:password by domain\n\n"
-            
-            f"<b>💰 PERSONAL COMMANDS:</b>\n"
-            f"<code>/mycredits</code> - View your credits\n"
-            f"<code>/mystats</code> - Your statistics\n"
-            f"<code>/referral</code> - Your referral link\n"
-            f"<code>/price</code> - Price information\n\n"
-            
-            f"<b>📊 INFORMATION:</b>\n"
-            f"<code>/info</code> - Bot information\n"
-            f"<code>/help</code> - This help\n\n"
-            
-            f"<b>👑 ADMIN COMMANDS:</b>\n"
-            f"<code>/addcredits</code> - Add credits\n"
-            f"<code>/userinfo</code> - User information\n"
-            f"<code>/stats</code> - Statistics\n"
-            f"<code>/userslist</code> - List users\n"
-            f"<code>/broadcast</code> - Send to all\n"
-            f"<code>/upload</code> - Upload ULP file\n\n"
-            
-            f"<b>📁 RESULTS DELIVERY:</b>\n"
-            f"• <5000 results → .txt file\n"
-            f"• ≥5000 results → .zip file (split into parts)\n"
-            f"• NO results shown in message\n\n"
-            
-            f"<b>💡 TIPS:</b>\n"
-            f"• Use specific terms for better results\n"
-            f"• Invite friends to earn free credits\n"
-            f"• Contact {BOT_OWNER} for more credits\n\n"
-            
-            f"<i>Bot developed by {BOT_OWNER}</i>"
-        )
-        
-        await update.message.reply_text(help_text, parse_mode='HTML')
+        await update.message.reply_text(HELP_MESSAGE, parse_mode='HTML')
     
     # ==================== ADMIN ====================
     
+    @admin_only
     async def addcredits_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ Admins only.")
-            return
-        
         if len(context.args) < 2:
             await update.message.reply_text(
                 "<b>❌ Usage:</b> <code>/addcredits user_id amount [daily/extra]</code>\n\n"
@@ -1535,14 +2603,19 @@ class ULPBot:
             )
             return
         
+        target_user = parse_int(context.args[0])
+        amount = parse_int(context.args[1])
+        
+        if target_user is None or amount is None:
+            await update.message.reply_text("❌ Error: Invalid ID or amount")
+            return
+        
+        credit_type = context.args[2] if len(context.args) > 2 else "extra"
+        
+        if credit_type not in ['daily', 'extra']:
+            credit_type = 'extra'
+        
         try:
-            target_user = int(context.args[0])
-            amount = int(context.args[1])
-            credit_type = context.args[2] if len(context.args) > 2 else "extra"
-            
-            if credit_type not in ['daily', 'extra']:
-                credit_type = 'extra'
-            
             success, message = self.credit_system.add_credits_to_user(target_user, amount, user_id, credit_type)
             
             if success:
@@ -1557,18 +2630,13 @@ class ULPBot:
             else:
                 await update.message.reply_text(f"❌ {message}")
                 
-        except ValueError:
-            await update.message.reply_text("❌ Error: Invalid ID or amount")
         except Exception as e:
             await update.message.reply_text(f"❌ Error: {str(e)}")
     
+    @admin_only
     async def userinfo_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         
-        if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ Admins only.")
-            return
-        
         if not context.args:
             await update.message.reply_text(
                 "<b>❌ Usage:</b> <code>/userinfo user_id</code>\n"
@@ -1577,24 +2645,28 @@ class ULPBot:
             )
             return
         
+        target_user = parse_int(context.args[0])
+        
+        if target_user is None:
+            await update.message.reply_text("❌ Error: Invalid user ID")
+            return
+        
         try:
-            target_user = int(context.args[0])
-            user_info = self.credit_system.get_user_info(target_user)
+            user_info = self.credit_system.get_user_profile(target_user)
             
             if not user_info:
                 await update.message.reply_text("❌ User not found")
                 return
             
-            total_credits = user_info['daily_credits'] + user_info['extra_credits']
-            referral_stats = self.credit_system.get_referral_stats(target_user)
-            referrals_count = referral_stats.get('referrals_count', 0) if referral_stats else 0
+            total_credits = user_info['total_credits']
+            referrals_count = user_info['referrals_count']
             
             response = (
                 f"<b>👤 USER INFORMATION</b>\n\n"
                 f"<b>Basic Info:</b>\n"
                 f"🆔 <b>ID:</b> <code>{user_info['user_id']}</code>\n"
-                f"👤 <b>Username:</b> @{user_info['username'] or 'N/A'}\n"
-                f"📛 <b>Name:</b> {user_info['first_name'] or 'N/A'}\n"
+                f"👤 <b>Username:</b> @{self.escape_html(user_info['username'] or 'N/A')}\n"
+                f"📛 <b>Name:</b> {self.escape_html(user_info['first_name'] or 'N/A')}\n"
                 f"📅 <b>Join date:</b> {user_info['join_date']}\n"
                 f"🔄 <b>Last reset:</b> {user_info.get('last_reset', 'N/A')}\n\n"
                 
@@ -1615,67 +2687,134 @@ class ULPBot:
             
             await update.message.reply_text(response, parse_mode='HTML')
             
-        except ValueError:
-            await update.message.reply_text("❌ Error: Invalid user ID")
         except Exception as e:
             await update.message.reply_text(f"❌ Error: {str(e)}")
     
+    @admin_only
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
+        bot_stats = self.credit_system.get_bot_stats_cached()
+        engine_stats = self.search_engine.get_stats()
         
-        if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ Admins only.")
-            return
+        file_lines = [
+            f"{i}. <code>{self.escape_html(f['name'])}</code> - {f['size'] / (1024 * 1024):.2f} MB ({f['modified']})"
+            for i, f in enumerate(engine_stats['recent_files'][:5], 1)
+        ]
+        recent_files = "\n".join(file_lines) or "<i>No files loaded</i>"
         
-        bot_stats = self.credit_system.get_bot_stats()
-        engine_stats = self.search_engine.get_stats()
+        response = STATS_TEMPLATE.format_map(ChainMap({
+            "total_files": engine_stats['total_files'],
+            "recent_files": recent_files,
+            "admin_username": update.effective_user.username,
+        }, bot_stats, TEMPLATE_CONSTANTS))
         
-        response = (
-            f"<b>📊 BOT STATISTICS</b>\n\n"
-            f"👥 <b>Users:</b> <code>{bot_stats['total_users']}</code>\n"
-            f"🔍 <b>Total searches:</b> <code>{bot_stats['total_searches']}</code>\n"
-            f"💰 <b>Total credits:</b> <code>{bot_stats['total_credits']}</code>\n"
-            f"👥 <b>Total referrals:</b> <code>{bot_stats.get('total_referrals', 0)}</code>\n"
-            f"📢 <b>Total broadcasts:</b> <code>{bot_stats.get('total_broadcasts', 0)}</code>\n"
-            f"📁 <b>Files in DB:</b> <code>{engine_stats['total_files']}</code>\n"
-            f"🔄 <b>Daily reset:</b> {RESET_HOUR}:00\n\n"
-            f"🤖 <b>Version:</b> {BOT_VERSION}\n"
-            f"👑 <b>Admin:</b> @{update.effective_user.username}"
+        # effective_message: también se llama desde el botón del panel admin
+        await update.effective_message.reply_text(response, parse_mode='HTML')
+    
+    def _render_users_page(self, offset: int, limit: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        """Una página de /userslist con botones de navegación"""
+        total_users = self.credit_system.get_user_count()
+        users = self.credit_system.get_all_users(limit=limit, offset=offset)
+        
+        if not users:
+            if total_users == 0:
+                return "📭 No registered users.", None
+            return f"📭 No users on this page (total: <code>{total_users}</code>).", None
+        
+        last = offset + len(users)
+        header = f"<b>📋 REGISTERED USERS</b> ({offset + 1}-{last} of {total_users})\n\n"
+        lines = (
+            f"{i}. {self.escape_html(f'@{username}' if username else first_name)} (<code>{uid}</code>) - "
+            f"🆓{daily} 💎{extra} 🔍{searches}\n"
+            for i, (uid, username, first_name, daily, extra, searches) in enumerate(users, offset + 1)
         )
         
-        await update.message.reply_text(response, parse_mode='HTML')
+        nav = []
+        if offset > 0:
+            nav.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"users:{max(0, offset - limit)}:{limit}"))
+        if last < total_users:
+            nav.append(InlineKeyboardButton("➡️ Next page", callback_data=f"users:{last}:{limit}"))
+        
+        reply_markup = InlineKeyboardMarkup([nav]) if nav else None
+        return header + ''.join(lines), reply_markup
     
+    @admin_only
     async def userslist_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
+        args = context.args or ()
+        limit = parse_int(args[0]) if len(args) >= 1 else USERS_PAGE_SIZE
+        offset = parse_int(args[1]) if len(args) >= 2 else 0
         
-        if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ Admins only.")
+        if limit is None or offset is None:
+            await update.message.reply_text(
+                "<b>❌ Usage:</b> <code>/userslist [limit] [offset]</code>",
+                parse_mode='HTML'
+            )
             return
         
-        users = self.credit_system.get_all_users(limit=20)
+        limit = max(1, min(limit, USERS_PAGE_MAX))
+        offset = max(0, offset)
         
-        if not users:
-            await update.message.reply_text("📭 No registered users.")
+        text, reply_markup = self._render_users_page(offset, limit)
+        await update.message.reply_text(text, parse_mode='HTML', reply_markup=reply_markup)
+    
+    @admin_only
+    async def multisearch_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Varios textos (p. ej. una lista de dominios) en una sola pasada"""
+        needles = list(dict.fromkeys(arg.lower() for arg in context.args or ()))
+        
+        if not needles or len(needles) > MULTISEARCH_MAX_NEEDLES:
+            await update.message.reply_text(
+                "<b>❌ Usage:</b> <code>/multisearch text1 text2 ...</code>\n\n"
+                f"Up to {MULTISEARCH_MAX_NEEDLES} texts, searched in one pass.",
+                parse_mode='HTML'
+            )
             return
         
-        response = "<b>📋 REGISTERED USERS</b>\n\n"
+        msg = await update.message.reply_text(
+            f"🔎 <b>Searching {len(needles)} texts...</b>", parse_mode='HTML'
+        )
+        
+        results = await asyncio.to_thread(self.search_engine.search_many, needles)
+        total_found = sum(len(lines) for lines in results.values())
         
-        for i, user in enumerate(users, 1):
-            username = f"@{user['username']}" if user['username'] else user['first_name']
-            daily = user['daily_credits']
-            extra = user['extra_credits']
-            searches = user['total_searches']
-            response += f"{i}. {self.escape_html(username)} (<code>{user['user_id']}</code>) - 🆓{daily} 💎{extra} 🔍{searches}\n"
+        summary = ''.join(
+            f"<code>{self.escape_html(needle)}</code>: {len(lines)}\n"
+            for needle, lines in results.items()
+        )
         
-        await update.message.reply_text(response, parse_mode='HTML')
+        if total_found == 0:
+            await msg.edit_text(f"<b>❌ NOT FOUND</b>\n\n{summary}", parse_mode='HTML')
+            return
+        
+        zip_buffer = await asyncio.to_thread(self.grouped_results_zip, results)
+        
+        await msg.reply_document(
+            document=zip_buffer,
+            filename=f"ulp_multisearch_{total_found}.zip",
+            caption=(
+                f"<b>📁 MULTISEARCH RESULTS</b>\n\n"
+                f"<b>Texts searched:</b> <code>{len(needles)}</code>\n"
+                f"<b>Results:</b> <code>{total_found}</code>"
+            ),
+            parse_mode='HTML'
+        )
+        
+        # El desglose por texto va en el mensaje (el caption se queda en 1024)
+        await msg.edit_text(f"<b>✅ Multisearch completed</b>\n\n{summary}", parse_mode='HTML')
     
-    async def broadcast_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        user_id = update.effective_user.id
+    async def users_page_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
         
-        if user_id not in ADMIN_IDS:
-            await update.message.reply_text("❌ Admins only.")
+        if query.from_user.id not in ADMIN_IDS:
+            await query.edit_message_text("❌ Admins only.")
             return
         
+        _, offset, limit = query.data.split(':')
+        text, reply_markup = self._render_users_page(int(offset), int(limit))
+        await self.edit_menu(query, text, reply_markup)
+    
+    @admin_only
+    async def broadcast_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "📢 <b>BROADCAST MESSAGE</b>\n\n"
             "Send the message you want to broadcast to all users.\n"
@@ -1694,8 +2833,7 @@ class ULPBot:
             return ConversationHandler.END
         
         message_text = update.message.text
-        users = self.credit_system.get_all_users_for_broadcast()
-        total_users = len(users)
+        total_users = self.credit_system.get_user_count()
         
         if total_users == 0:
             await update.message.reply_text("❌ No users to broadcast to.")
@@ -1703,7 +2841,7 @@ class ULPBot:
         
         msg = await update.message.reply_text(
             f"📢 <b>STARTING BROADCAST</b>\n\n"
-            f"<b>Message:</b> {message_text[:100]}...\n"
+            f"<b>Message:</b> {self.escape_html(message_text[:100])}...\n"
             f"<b>To users:</b> <code>{total_users}</code>\n\n"
             f"🔄 <i>Sending...</i>",
             parse_mode='HTML'
@@ -1712,35 +2850,61 @@ class ULPBot:
         sent_count = 0
         failed_count = 0
         
-        for user in users:
-            try:
-                await context.bot.send_message(
-                    chat_id=user,
-                    text=message_text,
-                    parse_mode='HTML'
-                )
-                sent_count += 1
+        # Productor (páginas de la DB) -> cola acotada -> workers que comparten
+        # un límite global de BROADCAST_RATE mensajes por segundo
+        bucket = TokenBucket(BROADCAST_RATE)
+        pending = asyncio.Queue(maxsize=BROADCAST_BATCH_SIZE)
+        
+        async def send(user: int):
+            while True:
+                await bucket.acquire()
+                try:
+                    return await context.bot.send_message(chat_id=user, text=message_text, parse_mode='HTML')
+                except RetryAfter as e:
+                    bucket.throttle()
+                    await asyncio.sleep(e.retry_after)
+        
+        async def worker():
+            nonlocal sent_count, failed_count
+            while (user := await pending.get()) is not None:
+                try:
+                    await send(user)
+                    sent_count += 1
+                except Forbidden:
+                    failed_count += 1
+                    logger.info(f"User {user} blocked the bot")
+                except Exception as e:
+                    failed_count += 1
+                    logger.error(f"Failed to send to {user}: {e}")
                 
-                if sent_count % 10 == 0:
-                    await msg.edit_text(
-                        f"📢 <b>BROADCAST IN PROGRESS</b>\n\n"
-                        f"✅ <b>Sent:</b> <code>{sent_count}</code>\n"
-                        f"❌ <b>Failed:</b> <code>{failed_count}</code>\n"
-                        f"📊 <b>Total:</b> <code>{total_users}</code>\n\n"
-                        f"🔄 <i>Sending...</i>",
-                        parse_mode='HTML'
-                    )
-                    await asyncio.sleep(0.5)
-                    
-            except Exception as e:
-                failed_count += 1
-                logger.error(f"Failed to send to {user}: {e}")
+                if (sent_count + failed_count) % BROADCAST_BATCH_SIZE == 0:
+                    # Un fallo al mostrar el progreso no debe parar el envío
+                    try:
+                        await msg.edit_text(
+                            f"📢 <b>BROADCAST IN PROGRESS</b>\n\n"
+                            f"✅ <b>Sent:</b> <code>{sent_count}</code>\n"
+                            f"❌ <b>Failed:</b> <code>{failed_count}</code>\n"
+                            f"📊 <b>Total:</b> <code>{total_users}</code>\n\n"
+                            f"🔄 <i>Sending...</i>",
+                            parse_mode='HTML'
+                        )
+                    except Exception as e:
+                        logger.warning(f"Broadcast progress update failed: {e}")
+        
+        workers = [asyncio.create_task(worker()) for _ in range(min(BROADCAST_CONCURRENCY, total_users))]
+        
+        for batch in self.credit_system.iter_broadcast_user_ids(BROADCAST_BATCH_SIZE):
+            for user in batch:
+                await pending.put(user)
+        for _ in workers:
+            await pending.put(None)
+        await asyncio.gather(*workers)
         
         self.credit_system.save_broadcast(user_id, message_text, sent_count, failed_count)
         
         await msg.edit_text(
             f"📢 <b>BROADCAST COMPLETED</b>\n\n"
-            f"<b>Message sent:</b> {message_text[:100]}...\n\n"
+            f"<b>Message sent:</b> {self.escape_html(message_text[:100])}...\n\n"
             f"✅ <b>Successfully sent:</b> <code>{sent_count}</code>\n"
             f"❌ <b>Failed:</b> <code>{failed_count}</code>\n"
             f"📊 <b>Total users:</b> <code>{total_users}</code>\n\n"
@@ -1764,24 +2928,39 @@ class ULPBot:
         
         document = update.message.document
         
-        if not document.file_name.endswith('.txt'):
+        if os.path.splitext(document.file_name or '')[1].lower() not in DATA_FILE_EXTS:
             await update.message.reply_text("❌ Only .txt files")
             return
         
+        # Rechazar antes de descargar nada
+        if document.mime_type and document.mime_type not in UPLOAD_MIME_TYPES:
+            await update.message.reply_text("❌ Only plain text files")
+            return
+        
+        if document.file_size and document.file_size > MAX_UPLOAD_SIZE:
+            await update.message.reply_text(
+                f"❌ File too large (max {MAX_UPLOAD_SIZE // (1024 * 1024)}MB)"
+            )
+            return
+        
         msg = await update.message.reply_text(f"📤 <b>Processing {self.escape_html(document.file_name)}...</b>", parse_mode='HTML')
         
         try:
             file = await document.get_file()
-            temp_path = os.path.join(UPLOAD_DIR, document.file_name)
-            await file.download_to_drive(temp_path)
             
-            success, result = self.search_engine.add_data_file(temp_path)
+            # Descarga a memoria (o a disco si es grande) y una sola escritura en DATA_DIR
+            with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE, dir=UPLOAD_DIR) as buffer:
+                await file.download_to_memory(out=buffer)
+                success, result, total_lines = await asyncio.to_thread(
+                    self.search_engine.add_data_fileobj, buffer, document.file_name
+                )
             
             if success:
                 stats = self.search_engine.get_stats()
                 await msg.edit_text(
                     f"<b>✅ FILE PROCESSED</b>\n\n"
                     f"<b>Name:</b> <code>{self.escape_html(document.file_name)}</code>\n"
+                    f"<b>Lines:</b> <code>{total_lines}</code>\n"
                     f"<b>Total files:</b> <code>{stats['total_files']}</code>\n\n"
                     f"✅ <i>Ready for searches</i>",
                     parse_mode='HTML'
@@ -1808,31 +2987,30 @@ class ULPBot:
         user_id = query.from_user.id
         
         if query.data == "menu_search":
-            await query.edit_message_text(
+            await self.edit_menu(
+                query,
                 "<b>🔍 SEARCH DOMAIN</b>\n\n"
                 "Send: <code>/search domain.com</code>\n\n"
                 "<b>Examples:</b>\n"
                 "<code>/search gmail.com</code>\n"
-                "<code>/search facebook.com</code>",
-                parse_mode='HTML'
+                "<code>/search facebook.com</code>"
             )
         
         elif query.data == "menu_email":
-            await query.edit_message_text(
+            await self.edit_menu(
+                query,
                 "<b>📧 SEARCH EMAIL</b>\n\n"
-                "Send: <code>/email user@gmail.com</code>",
-                parse_mode='HTML'
+                "Send: <code>/email user@gmail.com</code>"
             )
         
         elif query.data == "menu_credits":
-            total_credits = self.credit_system.get_user_credits(user_id)
-            daily_credits = self.credit_system.get_daily_credits_left(user_id)
-            await query.edit_message_text(
-                f"<b>💰 YOUR CREDITS</b>\n\n"
-                f"🆓 <b>Daily:</b> <code>{daily_credits}</code>/{MAX_FREE_CREDITS}\n"
-                f"🎯 <b>Total:</b> <code>{total_credits}</code>\n\n"
-                f"<i>Use /mycredits for details</i>",
-                parse_mode='HTML'
+            total_credits, daily_credits = self.credit_system.get_credit_snapshot(user_id)
+            await self.edit_menu(
+                query,
+                MENU_CREDITS_TEMPLATE.format_map(ChainMap({
+                    "daily_credits": daily_credits,
+                    "total_credits": total_credits,
+                }, TEMPLATE_CONSTANTS))
             )
         
         elif query.data == "menu_referral":
@@ -1850,27 +3028,23 @@ class ULPBot:
                 await query.edit_message_text("❌ Admins only.")
                 return
             
-            keyboard = [
-                [InlineKeyboardButton("📊 Statistics", callback_data="admin_stats")],
-                [InlineKeyboardButton("📋 List Users", callback_data="admin_users")],
-                [InlineKeyboardButton("📢 Broadcast", callback_data="admin_broadcast")],
-                [InlineKeyboardButton("📤 Upload File", callback_data="admin_upload")],
-            ]
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
+            await self.edit_menu(
+                query,
                 "<b>👑 ADMIN PANEL</b>\n\n"
                 "<i>Select an option:</i>",
-                parse_mode='HTML',
-                reply_markup=reply_markup
+                ADMIN_PANEL_KEYBOARD
             )
         
         elif query.data == "admin_stats":
             await self.stats_command(update, context)
         
         elif query.data == "admin_users":
-            await self.userslist_command(update, context)
+            if user_id not in ADMIN_IDS:
+                await query.edit_message_text("❌ Admins only.")
+                return
+            
+            text, reply_markup = self._render_users_page(0, USERS_PAGE_SIZE)
+            await self.edit_menu(query, text, reply_markup)
         
         elif query.data == "admin_broadcast":
             await update.callback_query.message.reply_text(
@@ -1881,31 +3055,40 @@ class ULPBot:
             )
         
         elif query.data == "admin_upload":
-            await query.edit_message_text(
+            await self.edit_menu(
+                query,
                 "<b>📤 UPLOAD FILE</b>\n\n"
                 "To upload a file:\n"
                 "1. Send a .txt file\n"
                 "2. Format: email:pass, url:email:pass, login:pass, DNI:pass\n"
-                "3. Max 50MB\n\n"
-                "File will be indexed automatically.",
-                parse_mode='HTML'
+                f"3. Max {MAX_UPLOAD_SIZE // (1024 * 1024)}MB\n\n"
+                "File will be indexed automatically."
             )
 
 # ============================================================================
 # MAIN EXECUTION
 # ============================================================================
 
-def run_flask():
-    app.run(host='0.0.0.0', port=PORT, threaded=True)
-
 def main():
     logger.info(f"🚀 Starting {BOT_NAME} v{BOT_VERSION}")
     
+    # Antes de crear la Application: run_polling usa el bucle de la política
+    if uvloop is not None:
+        uvloop.install()
+    
     search_engine = SearchEngine()
     credit_system = CreditSystem()
     bot = ULPBot(search_engine, credit_system)
     
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # El health check y el reset diario corren en el mismo bucle que el bot
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(ChatSerialUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(bot.post_init)
+        .post_shutdown(bot.post_shutdown)
+        .build()
+    )
     
     # Search handlers
     search_conv = ConversationHandler(
@@ -1949,6 +3132,7 @@ def main():
     application.add_handler(CommandHandler("userinfo", bot.userinfo_command))
     application.add_handler(CommandHandler("stats", bot.stats_command))
     application.add_handler(CommandHandler("userslist", bot.userslist_command))
+    application.add_handler(CommandHandler("multisearch", bot.multisearch_command))
     application.add_handler(broadcast_conv)
     application.add_handler(MessageHandler(filters.Document.ALL, bot.handle_document))
     
@@ -1956,11 +3140,11 @@ def main():
     application.add_handler(CallbackQueryHandler(bot.button_handler, pattern='^menu_'))
     application.add_handler(CallbackQueryHandler(bot.button_handler, pattern='^admin_'))
     application.add_handler(CallbackQueryHandler(bot.button_handler, pattern='^copy_'))
+    application.add_handler(CallbackQueryHandler(bot.users_page_callback, pattern='^users:'))
     
-    # Start Flask
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    logger.info(f"🌐 Flask on port {PORT}")
+    # Indexar en segundo plano lo que ya estaba en DATA_DIR
+    index_thread = threading.Thread(target=search_engine.index_pending_files, daemon=True)
+    index_thread.start()
     
     # Start bot
     logger.info("🤖 Bot started")